@@ -0,0 +1,171 @@
+"""
+    Severe weather alerts by ID.
+
+    The alerts in each response are compared to the ones already known
+    for the location, so that only alerts that are new, have changed or
+    have expired cause node updates.  A response that is the same as
+    the last one is recognized by its digest and costs nothing beyond
+    checking for alerts that have passed their expiry time.
+
+    Alerts are polled every FAST_INTERVAL seconds instead of at the
+    normal rate while a location has active alerts or the current
+    conditions show a storm nearby.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import time
+import json
+import calendar
+import hashlib
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+FAST_INTERVAL = 60      # seconds between alert queries when it matters
+
+# Current condition codes that mean a storm is close: thunderstorms,
+# heavy rain and heavy snow.
+STORM_CODES = set(range(200, 234)) | {502, 522, 602, 622}
+
+# Fields that make up an alert's content
+CONTENT = ('title', 'severity', 'description', 'effective_utc', 'onset_utc',
+           'ends_utc', 'expires_utc', 'regions')
+
+def storm_near(code):
+    try:
+        return int(code) in STORM_CODES
+    except (TypeError, ValueError):
+        return False
+
+# WeatherBit alerts have no ID field, the URI of the issuing agency's
+# alert is unique.
+def alert_id(alert):
+    if alert.get('uri'):
+        return alert['uri']
+    return '|'.join([str(alert.get(f)) for f in ('title', 'effective_utc', 'regions')])
+
+def digest(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+def expiry(alert):
+    for field in ('expires_utc', 'ends_utc'):
+        if alert.get(field):
+            try:
+                return calendar.timegm(time.strptime(alert[field], '%Y-%m-%dT%H:%M:%S'))
+            except ValueError:
+                pass
+    return None
+
+class AlertIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.alerts = {}        # id -> (content digest, alert, expiry)
+        self.last = None        # digest of the last response
+
+    """
+        Update the index from the 'alerts' list of a response.  Returns
+        (new, changed, expired) lists of alert IDs, all empty if nothing
+        changed.
+    """
+    def update(self, alerts, now=None):
+        if now is None:
+            now = time.time()
+        response = digest(alerts)
+        with self.lock:
+            new = []
+            changed = []
+            if response != self.last:
+                self.last = response
+                seen = set()
+                for alert in alerts:
+                    aid = alert_id(alert)
+                    seen.add(aid)
+                    content = digest([alert.get(f) for f in CONTENT])
+                    known = self.alerts.get(aid)
+                    if known is not None and known[0] == content:
+                        continue
+                    when = expiry(alert)
+                    if when is not None and when <= now:
+                        continue
+                    if known is None:
+                        new.append(aid)
+                    else:
+                        changed.append(aid)
+                    self.alerts[aid] = (content, alert, when)
+                expired = [aid for aid in self.alerts if aid not in seen]
+            else:
+                expired = []
+
+            # Alerts still in the response after their expiry time
+            expired += [aid for aid in self.alerts if aid not in expired and
+                        self.alerts[aid][2] is not None and self.alerts[aid][2] <= now]
+            for aid in expired:
+                del self.alerts[aid]
+        return (new, changed, expired)
+
+    def get(self, aid):
+        with self.lock:
+            entry = self.alerts.get(aid)
+        return entry[1] if entry is not None else None
+
+    def active(self):
+        with self.lock:
+            return [self.alerts[aid][1] for aid in self.alerts]
+
+"""
+    Ticks the poll worker while any location needs fast alert polling.
+    The scheduler decides which alert queries are actually due, so the
+    ticks are more frequent than FAST_INTERVAL to start each query
+    close to its time.
+"""
+class FastPoll:
+    def __init__(self, tick, interval=FAST_INTERVAL / 4):
+        self.tick = tick
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.locations = set()
+        self.stopped = False
+        self.thread = None
+
+    # Turn fast polling on or off for a location.  Returns True if that
+    # changed anything.
+    def set(self, index, fast):
+        with self.condition:
+            if fast == (index in self.locations) or self.stopped:
+                return False
+            if fast:
+                self.locations.add(index)
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._loop, name='alerts', daemon=True)
+                    self.thread.start()
+            else:
+                self.locations.discard(index)
+            self.condition.notify()
+        return True
+
+    def active(self):
+        with self.condition:
+            return set(self.locations)
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while not self.locations and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                self.condition.wait(self.interval)
+                if self.stopped:
+                    return
+                if not self.locations:
+                    continue
+            self.tick()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.locations = set()
+            self.condition.notify()
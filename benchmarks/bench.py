@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+    Microbenchmarks for the weather functions and node update paths.
+
+    Runs against the recorded WeatherBit responses in fixtures/ and the
+    stub polyinterface in this directory, so no network access, API key
+    or Polyglot is needed.
+
+    For each benchmark the time per call, the peak memory allocated by
+    one call and the number of setDriver calls are reported.
+
+        python3 benchmarks/bench.py                      run all
+        python3 benchmarks/bench.py -k forecast          run matching names
+        python3 benchmarks/bench.py --save base.json     store a baseline
+        python3 benchmarks/bench.py --compare base.json  compare to baseline
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import itertools
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(1, os.path.dirname(HERE))
+
+import polyinterface
+from weather_funcs import et3
+from weather_funcs import uom
+import ns_parameters
+import json_stream
+import circuit_breaker
+import weatherbit_server
+from nodes import Controller
+
+FIXTURES = os.path.join(HERE, 'fixtures')
+MIN_TIME = 0.2     # seconds each timing run should take
+REPEAT = 5         # timing runs, the fastest is reported
+THRESHOLD = 10.0   # percent slower than baseline to flag
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+# Returns the fixtures instead of querying WeatherBit
+class FixtureAPI:
+    def __init__(self):
+        self.responses = {
+                'current': load_fixture('current.json'),
+                'forecast/daily': load_fixture('forecast_daily.json'),
+                'forecast/hourly': load_fixture('forecast_hourly.json'),
+                'current/airquality': load_fixture('current_airquality.json'),
+                'forecast/airquality': load_fixture('forecast_airquality.json'),
+                'alerts': load_fixture('alerts.json'),
+                }
+        weatherbit_server.shift_hours(self.responses['forecast/hourly']['data'])
+        weatherbit_server.shift_hours(self.responses['forecast/airquality']['data'])
+        weatherbit_server.shift_alerts(self.responses['alerts']['alerts'])
+        self.breaker = circuit_breaker.CircuitBreaker()
+
+    def get(self, endpoint, location, apikey, units, extra=None, fields=None,
+            on_record=None):
+        jdata = self.responses[endpoint]
+        if extra and 'days' in extra:
+            jdata = dict(jdata, data=jdata['data'][0:extra['days']])
+        if extra and 'hours' in extra:
+            jdata = dict(jdata, data=jdata['data'][0:extra['hours']])
+        json_stream.replay(jdata, on_record)
+        return jdata
+
+    def fresh(self, endpoint, location, units, extra=None, fields=None):
+        return False
+
+    def reset(self):
+        pass
+
+    def set_base_url(self, base_url):
+        pass
+
+    def close(self):
+        pass
+
+def make_controller(days=16, units='M', hours=48):
+    control = Controller.Controller(polyinterface.Interface('WeatherBit'))
+    control.api = FixtureAPI()
+    control.params.set('APIkey', 'bench')
+    control.params.set('Location', 'lat=35.78&lon=-78.64')
+    control.params.set('Forecast Days', str(days))
+    control.params.set('Forecast Hours', str(hours))
+    control.params.set('Units', units)
+    control.params.set('History Days', '0')
+    control.params.set('Air Quality', 'true')
+    control.params.set('Alerts', 'true')
+    control.configured = True
+    control.discover()
+    return control
+
+# Forced conditions, forecast and hourly queries, as in a poll cycle
+def all_queries(control, batched=False):
+    if batched:
+        control.batch.open()
+    control.query_conditions(True)
+    control.query_forecast(True)
+    control.query_hourly(True)
+    control.batch.flush()
+
+def build_benchmarks():
+    forecast = load_fixture('forecast_daily.json')
+    days = forecast['data']
+    day = days[0]
+    latitude = float(forecast['lat'])
+
+    control = make_controller()
+    daily = control.nodes['forecast_0']
+    # alternate between two days so the drivers actually change
+    changing_days = itertools.cycle(days[0:2])
+
+    params = ns_parameters.NSParameters([{
+        'name': name, 'default': '0', 'isRequired': False, 'notice': ''}
+        for name in ('APIkey', 'Location', 'Elevation', 'Units',
+                     'Forecast Days', 'Plant Type')])
+
+    max_t = [d['max_temp'] for d in days]
+    min_t = [d['min_temp'] for d in days]
+    ws = [d['wind_spd'] for d in days]
+    rh = [d['rh'] for d in days]
+    jd = [189 + i for i in range(0, len(days))]
+    crops = [0.1 + 0.05 * i for i in range(0, 8)]
+    crop_column = [[c] for c in crops]
+
+    benchmarks = [
+        ('et3.evapotranspriation',
+            lambda: et3.evapotranspriation(day['max_temp'], day['min_temp'], None,
+                                           day['wind_spd'], 100.0, day['rh'], day['rh'],
+                                           latitude, 0.23, 189)),
+        ('et3.evapotranspriation x16',
+            lambda: [et3.evapotranspriation(max_t[i], min_t[i], None, ws[i], 100.0,
+                                            rh[i], rh[i], latitude, 0.23, jd[i])
+                     for i in range(0, len(days))]),
+        ('et3.evapotranspriation_array x16',
+            lambda: et3.evapotranspriation_array(max_t, min_t, ws, 100.0, rh, rh,
+                                                 latitude, 0.23, jd)),
+        ('et3.evapotranspriation x16 x8 crops',
+            lambda: [[et3.evapotranspriation(max_t[i], min_t[i], None, ws[i], 100.0,
+                                             rh[i], rh[i], latitude, c, jd[i])
+                      for i in range(0, len(days))] for c in crops]),
+        ('et3.evapotranspriation_array x16 x8 crops',
+            lambda: et3.evapotranspriation_array(max_t, min_t, ws, 100.0, rh, rh,
+                                                 latitude, crop_column, jd)),
+        ('uom.get_uom',
+            lambda: uom.get_uom('I')),
+        ('NSParameters.get',
+            lambda: params.get('Plant Type')),
+        ('DailyNode.update_forecast',
+            lambda: daily.update_forecast(next(changing_days))),
+        ('Controller.query_conditions',
+            lambda: control.query_conditions(True)),
+        ('Controller.query_conditions unchanged',
+            lambda: control.query_conditions(False)),
+        ('Controller.query_forecast',
+            lambda: control.query_forecast(True)),
+        ('Controller.query_forecast unchanged',
+            lambda: control.query_forecast(False)),
+        ('Controller.query_hourly',
+            lambda: control.query_hourly(True)),
+        ('Controller.query_hourly unchanged',
+            lambda: control.query_hourly(False)),
+        ('Controller.query_airquality',
+            lambda: control.query_airquality(True)),
+        ('Controller.query_aq_forecast',
+            lambda: control.query_aq_forecast(True)),
+        ('Controller.query_alerts',
+            lambda: control.query_alerts(True)),
+        ('Controller.query_alerts unchanged',
+            lambda: control.query_alerts(False)),
+        ('Controller.cycle_jobs',
+            lambda: control.cycle_jobs(True)),
+        ('Controller forced queries',
+            lambda: all_queries(control)),
+        ('Controller forced queries batched',
+            lambda: all_queries(control, True)),
+        ]
+    return (benchmarks, control)
+
+# Time per call in microseconds, fastest of REPEAT runs
+def time_per_call(func):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIME:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(MIN_TIME / elapsed) + 1)
+
+    best = elapsed
+    for _ in range(REPEAT - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number * 1e6
+
+# Peak bytes allocated during a single call.  Tracing starts fresh for
+# each call, so the peak is only this call's.
+def peak_allocation(func):
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+def set_driver_count(func):
+    before = polyinterface.Node.set_driver_calls
+    func()
+    return polyinterface.Node.set_driver_calls - before
+
+def run(pattern=None):
+    (benchmarks, control) = build_benchmarks()
+    results = {}
+    try:
+        for (name, func) in benchmarks:
+            if pattern and pattern not in name:
+                continue
+            func()  # warm up caches
+            results[name] = {
+                    'usec': time_per_call(func),
+                    'peak_kib': peak_allocation(func) / 1024.0,
+                    'set_driver': set_driver_count(func),
+                    }
+    finally:
+        control.engine.shutdown()
+    return results
+
+def report(results, baseline=None):
+    regressions = []
+    print('%-40s %12s %10s %10s %9s' % ('benchmark', 'usec/call', 'peak KiB', 'setDriver', 'change'))
+    for name in results:
+        r = results[name]
+        change = ''
+        if baseline is not None and name in baseline:
+            pct = (r['usec'] - baseline[name]['usec']) / baseline[name]['usec'] * 100.0
+            change = '%+.1f%%' % pct
+            if pct > THRESHOLD:
+                change += ' !'
+                regressions.append(name)
+        print('%-40s %12.2f %10.2f %10d %9s' % (name, r['usec'], r['peak_kib'], r['set_driver'], change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='WeatherBit node server benchmarks')
+    parser.add_argument('-k', dest='pattern', help='only run benchmarks containing this text')
+    parser.add_argument('--save', help='write the results to this baseline file')
+    parser.add_argument('--compare', help='compare the results to this baseline file')
+    args = parser.parse_args()
+
+    # The controller persists its response cache in the current directory
+    cwd = os.getcwd()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            results = run(args.pattern)
+        finally:
+            os.chdir(cwd)
+
+    regressions = report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': sys.version.split()[0],
+                'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'results': results,
+                }, f, indent=2)
+
+    if regressions:
+        print('%d benchmarks are more than %d%% slower than the baseline' %
+              (len(regressions), THRESHOLD))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+    Load test the WeatherBit transport against the stand-in server.
+
+    Queries current conditions and the daily forecast for many
+    locations concurrently through WeatherBitAPI and reports the
+    throughput and latency percentiles.  Unless --url is given, a
+    stand-in server is started in this process with the requested
+    latency and error injection.
+
+        python3 benchmarks/load.py --locations 50 --cycles 5 --latency 0.05 \
+                --error-rate 0.02 --limit-rate 0.01
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(1, os.path.dirname(HERE))
+
+import weatherbit_api
+import weatherbit_server
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def main():
+    parser = argparse.ArgumentParser(description='WeatherBit transport load test')
+    parser.add_argument('--url', help='use a running server instead of starting one')
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=weatherbit_api.POOL_SIZE)
+    parser.add_argument('--cache', action='store_true', help='keep the response cache enabled')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--limit-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        stand_in = weatherbit_server.StandIn(os.path.join(HERE, 'fixtures'),
+                                             args.latency, args.jitter,
+                                             args.error_rate, args.limit_rate)
+        server = weatherbit_server.serve(stand_in, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:%d/v2.0/' % server.server_address[1]
+
+    api = weatherbit_api.WeatherBitAPI(base_url=url, pool_size=args.workers)
+    if not args.cache:
+        for endpoint in list(api.cache.ttl):
+            api.cache.ttl[endpoint] = 0
+
+    locations = ['lat=%.3f&lon=%.3f' % (random.uniform(-60, 60), random.uniform(-180, 180))
+                 for _ in range(args.locations)]
+    queries = [('current', None), ('forecast/daily', {'days': 16})]
+
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+
+    def fetch(location, endpoint, extra):
+        start = time.perf_counter()
+        error = None
+        try:
+            api.get(endpoint, location, 'load-test', 'M', extra)
+        except Exception as e:
+            error = type(e).__name__
+            if hasattr(e, 'response') and e.response is not None:
+                error = str(e.response.status_code)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if error is not None:
+                errors[error] = errors.get(error, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for _ in range(args.cycles):
+            futures = [pool.submit(fetch, location, endpoint, extra)
+                       for location in locations for (endpoint, extra) in queries]
+            for f in futures:
+                f.result()
+    total = time.perf_counter() - start
+
+    api.close()
+    if server is not None:
+        server.shutdown()
+
+    print('requests    %d in %.2f s (%.1f/s)' % (len(latencies), total, len(latencies) / total))
+    for pct in (50, 90, 99):
+        print('p%-10d %.1f ms' % (pct, percentile(latencies, pct) * 1000))
+    print('max         %.1f ms' % (max(latencies) * 1000 if latencies else 0))
+    for e in sorted(errors):
+        print('errors %-5s %d' % (e, errors[e]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+    Minimal stand-in for polyinterface used by the benchmarks.
+
+    Only what the node server uses is provided.  setDriver keeps the
+    value and counts the calls so a benchmark can report how many
+    driver updates a pass would send to Polyglot.
+"""
+
+import logging
+
+LOGGER = logging.getLogger('weatherbit-bench')
+LOGGER.addHandler(logging.NullHandler())
+LOGGER.setLevel(logging.CRITICAL)
+
+class Node:
+    set_driver_calls = 0
+
+    def __init__(self, controller, primary, address, name):
+        self.controller = controller
+        self.parent = controller
+        self.primary = primary
+        self.address = address
+        self.name = name
+        self.poly = getattr(controller, 'poly', None)
+        self._drivers = {}
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        Node.set_driver_calls += 1
+        self._drivers[driver] = (value, uom)
+
+    def getDriver(self, driver):
+        if driver in self._drivers:
+            return self._drivers[driver][0]
+        return None
+
+    def reportDrivers(self):
+        pass
+
+class Controller(Node):
+    def __init__(self, poly):
+        self.poly = poly
+        self.nodes = {}
+        self.polyConfig = {'customParams': {}, 'customData': {}}
+        super(Controller, self).__init__(self, 'weather', 'weather', 'Controller')
+
+    def addNode(self, node):
+        self.nodes[node.address] = node
+        return node
+
+    def delNode(self, address):
+        self.nodes.pop(address, None)
+
+    def addNotice(self, *args):
+        pass
+
+    def removeNoticesAll(self):
+        pass
+
+    def addCustomParam(self, params):
+        pass
+
+class Interface:
+    def __init__(self, name=None):
+        self.config = {}
+
+    def onConfig(self, callback):
+        pass
+
+    def saveCustomData(self, data):
+        pass
+
+    def installprofile(self):
+        return True
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+    Local stand-in for the WeatherBit API.
+
+    Serves /v2.0/current, /v2.0/forecast/daily, /v2.0/forecast/hourly,
+    /v2.0/history/daily, /v2.0/current/airquality,
+    /v2.0/forecast/airquality and /v2.0/alerts by replaying the
+    recorded responses in fixtures/, so the node server can be load
+    and failure tested without the real service or an API key.  Point
+    the node server at it with the API URL parameter, i.e.
+
+        API URL = http://localhost:8080/v2.0/
+
+    Each location gets its own copy of the fixture with the lat/lon
+    from the query, so any number of locations can be served.  Latency,
+    server errors and 429 (rate limit) responses can be injected and a
+    daily call quota is tracked in the X-RateLimit headers the same way
+    the real service does.
+
+        python3 benchmarks/weatherbit_server.py --port 8080 --latency 0.2 \
+                --jitter 0.1 --error-rate 0.05 --limit-rate 0.01
+"""
+
+import os
+import sys
+import json
+import time
+import copy
+import random
+import calendar
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+ENDPOINTS = {
+        '/v2.0/current': 'current.json',
+        '/v2.0/forecast/daily': 'forecast_daily.json',
+        '/v2.0/forecast/hourly': 'forecast_hourly.json',
+        '/v2.0/history/daily': 'forecast_daily.json',
+        '/v2.0/current/airquality': 'current_airquality.json',
+        '/v2.0/forecast/airquality': 'forecast_airquality.json',
+        '/v2.0/alerts': 'alerts.json',
+        }
+
+class StandIn:
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, error_rate=0.0,
+                 limit_rate=0.0, quota=None, max_age=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.limit_rate = limit_rate
+        self.quota = quota
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.day = self.today()
+
+        self.fixtures = {}
+        for path in ENDPOINTS:
+            with open(os.path.join(fixtures, ENDPOINTS[path])) as f:
+                self.fixtures[path] = json.load(f)
+
+    def today(self):
+        return int(time.time() // 86400)
+
+    # Count the call against the daily quota, returns calls remaining
+    def count_call(self):
+        with self.lock:
+            if self.today() != self.day:
+                self.day = self.today()
+                self.calls = 0
+            self.calls += 1
+            if self.quota is None:
+                return None
+            return self.quota - self.calls
+
+    def rate_headers(self, remaining):
+        if remaining is None:
+            return {}
+        return {
+                'X-RateLimit-Limit': str(self.quota),
+                'X-RateLimit-Remaining': str(max(remaining, 0)),
+                'X-RateLimit-Reset': str((self.day + 1) * 86400),
+                }
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    # Fixture data for the location in the query
+    def payload(self, path, query):
+        data = copy.deepcopy(self.fixtures[path])
+        lat = query.get('lat', [None])[0]
+        lon = query.get('lon', [None])[0]
+        if lat is not None and lon is not None:
+            if path == '/v2.0/current':
+                for ob in data['data']:
+                    ob['lat'] = float(lat)
+                    ob['lon'] = float(lon)
+            else:
+                data['lat'] = lat
+                data['lon'] = lon
+        if path == '/v2.0/forecast/daily':
+            if 'days' in query:
+                data['data'] = data['data'][0:int(query['days'][0])]
+            shift_days(data['data'])
+        if path == '/v2.0/forecast/hourly':
+            if 'hours' in query:
+                data['data'] = data['data'][0:int(query['hours'][0])]
+            shift_hours(data['data'])
+        if path == '/v2.0/forecast/airquality':
+            shift_hours(data['data'])
+        if path == '/v2.0/alerts':
+            shift_alerts(data['alerts'])
+        if path == '/v2.0/history/daily':
+            data['data'] = history_days(data['data'], query)
+        return data
+
+# The daily forecast records reused for each day from start_date up to,
+# but not including, end_date.
+def history_days(records, query):
+    start = calendar.timegm(time.strptime(query['start_date'][0], '%Y-%m-%d'))
+    end = calendar.timegm(time.strptime(query['end_date'][0], '%Y-%m-%d'))
+    days = []
+    for (i, ts) in enumerate(range(start, end, 86400)):
+        record = dict(records[i % len(records)])
+        record['ts'] = ts
+        record['datetime'] = time.strftime('%Y-%m-%d', time.gmtime(ts))
+        days.append(record)
+    return days
+
+# Move the hourly forecast so it starts with the current hour
+def shift_hours(records):
+    if not records:
+        return
+    now = int(time.time())
+    offset = now - now % 3600 - int(records[0]['ts'])
+    for r in records:
+        r['ts'] = int(r['ts']) + offset
+
+# Move the alerts so that the recorded time ALERTS_RECORDED is the
+# start of the current hour.  The offset only changes on the hour, so repeated queries get the
+# same response.
+ALERTS_RECORDED = calendar.timegm(time.strptime('2020-07-10T20:00:00', '%Y-%m-%dT%H:%M:%S'))
+ALERT_TIMES = ('effective', 'onset', 'ends', 'expires')
+
+def shift_alerts(alerts):
+    now = int(time.time())
+    offset = now - now % 3600 - ALERTS_RECORDED
+    for a in alerts:
+        for t in ALERT_TIMES:
+            for zone in ('_utc', '_local'):
+                if a.get(t + zone):
+                    ts = calendar.timegm(time.strptime(a[t + zone], '%Y-%m-%dT%H:%M:%S'))
+                    a[t + zone] = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts + offset))
+
+# Move the daily forecast so it starts today
+def shift_days(records):
+    if not records:
+        return
+    today = calendar.timegm(time.strptime(time.strftime('%Y-%m-%d'), '%Y-%m-%d'))
+    offset = today - calendar.timegm(time.strptime(records[0]['valid_date'], '%Y-%m-%d'))
+    for r in records:
+        r['ts'] = int(r['ts']) + offset
+        r['valid_date'] = time.strftime('%Y-%m-%d', time.gmtime(
+            calendar.timegm(time.strptime(r['valid_date'], '%Y-%m-%d')) + offset))
+
+def make_handler(stand_in):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, data, headers):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for h in headers:
+                self.send_header(h, headers[h])
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            stand_in.delay()
+
+            if url.path not in ENDPOINTS:
+                self.send_json(404, {'error': 'Invalid endpoint'}, {})
+                return
+            if 'key' not in query:
+                self.send_json(403, {'error': 'API key not valid'}, {})
+                return
+
+            remaining = stand_in.count_call()
+            headers = stand_in.rate_headers(remaining)
+
+            if (remaining is not None and remaining < 0) or \
+                    random.random() < stand_in.limit_rate:
+                headers['Retry-After'] = '60'
+                self.send_json(429, {'error': 'API key limit reached'}, headers)
+                return
+            if random.random() < stand_in.error_rate:
+                self.send_json(500, {'error': 'Injected server error'}, headers)
+                return
+
+            data = stand_in.payload(url.path, query)
+            etag = '"' + hashlib.md5(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest() + '"'
+            headers['ETag'] = etag
+            if stand_in.max_age is not None:
+                headers['Cache-Control'] = 'max-age=%d' % stand_in.max_age
+
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                for h in headers:
+                    self.send_header(h, headers[h])
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            self.send_json(200, data, headers)
+
+    return Handler
+
+def serve(stand_in, host='127.0.0.1', port=8080):
+    server = ThreadingHTTPServer((host, port), make_handler(stand_in))
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Local WeatherBit stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--fixtures', default=os.path.join(HERE, 'fixtures'),
+                        help='directory with the recorded responses')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random +/- seconds of latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of 500 responses')
+    parser.add_argument('--limit-rate', type=float, default=0.0, help='fraction of 429 responses')
+    parser.add_argument('--quota', type=int, default=None, help='calls per day before 429')
+    parser.add_argument('--max-age', type=int, default=None, help='Cache-Control max-age to send')
+    args = parser.parse_args()
+
+    stand_in = StandIn(args.fixtures, args.latency, args.jitter, args.error_rate,
+                       args.limit_rate, args.quota, args.max_age)
+    server = serve(stand_in, args.host, args.port)
+    print('Serving WeatherBit stand-in on http://%s:%d/v2.0/' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
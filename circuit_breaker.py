@@ -0,0 +1,134 @@
+"""
+    Per endpoint circuit breaker for the WeatherBit API.
+
+    After FAILURES failed queries in a row the endpoint's circuit opens
+    and no queries are sent for OPEN_TIME seconds.  After that a single
+    query is let through (half open).  If it works the circuit closes
+    again, if not it stays open for twice as long, up to MAX_OPEN_TIME.
+
+    Only failures that say the service is in trouble count: connection
+    errors, timeouts and 5xx responses.  Rate limiting is handled by the
+    poll scheduler.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import time
+import random
+import threading
+import requests
+
+LOGGER = polyinterface.LOGGER
+
+FAILURES = 3           # failures in a row before the circuit opens
+OPEN_TIME = 60         # seconds the circuit stays open the first time
+MAX_OPEN_TIME = 1800
+
+RETRIES = 2            # extra attempts for each query
+RETRY_DELAY = 1.0      # base delay, doubled for each retry
+MAX_RETRY_DELAY = 8.0
+
+# Circuit states
+CLOSED = 0
+HALF_OPEN = 1
+OPEN = 2
+
+# Health reported by the controller
+HEALTHY = 0
+DEGRADED = 1
+DOWN = 2
+
+class CircuitOpenError(Exception):
+    pass
+
+# Is this exception a sign that the service is failing?  Anything else
+# means the service did answer.
+def retryable(e):
+    if isinstance(e, requests.exceptions.HTTPError):
+        return e.response is not None and e.response.status_code >= 500
+    # connection errors, timeouts, broken or incomplete responses
+    return isinstance(e, (requests.exceptions.RequestException, ValueError))
+
+# Exponential backoff with full jitter
+def retry_delay(attempt):
+    return random.uniform(0, min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** attempt))
+
+class Circuit:
+    __slots__ = ('state', 'failures', 'open_time', 'opened', 'trial')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.open_time = OPEN_TIME
+        self.opened = 0
+        self.trial = False
+
+class CircuitBreaker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.circuits = {}
+
+    def _circuit(self, endpoint):
+        if endpoint not in self.circuits:
+            self.circuits[endpoint] = Circuit()
+        return self.circuits[endpoint]
+
+    # Can a query be sent to this endpoint?
+    def allow(self, endpoint):
+        now = time.time()
+        with self.lock:
+            c = self._circuit(endpoint)
+            if c.state == CLOSED:
+                return True
+            if c.state == OPEN:
+                if now < c.opened + c.open_time:
+                    return False
+                c.state = HALF_OPEN
+                c.trial = False
+            # Half open, only one query at a time is let through
+            if c.trial:
+                return False
+            c.trial = True
+            return True
+
+    def success(self, endpoint):
+        with self.lock:
+            c = self._circuit(endpoint)
+            if c.state != CLOSED:
+                LOGGER.info('WeatherBit ' + endpoint + ' is working again')
+            c.state = CLOSED
+            c.failures = 0
+            c.open_time = OPEN_TIME
+            c.trial = False
+
+    def failure(self, endpoint):
+        with self.lock:
+            c = self._circuit(endpoint)
+            c.failures += 1
+            if c.state == HALF_OPEN:
+                c.open_time = min(c.open_time * 2, MAX_OPEN_TIME)
+            elif c.failures < FAILURES:
+                return
+            c.state = OPEN
+            c.opened = time.time()
+            c.trial = False
+            LOGGER.warning('WeatherBit %s is failing, pausing queries for %d seconds' %
+                           (endpoint, c.open_time))
+
+    # Overall health, the worst of all the endpoints
+    def health(self):
+        health = HEALTHY
+        with self.lock:
+            for endpoint in self.circuits:
+                c = self.circuits[endpoint]
+                if c.state == OPEN:
+                    return DOWN
+                if c.state == HALF_OPEN or c.failures > 0:
+                    health = DEGRADED
+        return health
+
+    def reset(self):
+        with self.lock:
+            self.circuits = {}
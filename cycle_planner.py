@@ -0,0 +1,93 @@
+"""
+    Plans the fetch jobs for a poll cycle.
+
+    Each data source (current conditions, daily forecast, air quality,
+    alerts, ...) is one WeatherBit endpoint queried for each location.
+    For every source and location the planner decides whether a query
+    is needed:
+
+     - locations with the same Location string are fetched once, the
+       other locations sharing it are updated from the cached response
+       by the same job,
+     - a source whose cached response is still within its TTL isn't
+       queried again, the nodes already have that data,
+     - otherwise the scheduler decides if the query is due.
+
+    A job that the fetch engine doesn't start is handed back with
+    release() so the scheduler doesn't count it as done.
+
+    All the jobs go through the same WeatherBitAPI, so they share its
+    connection pool, response cache and circuit breaker.  Forced cycles
+    skip the TTL check.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+"""
+    A data source.  query(force, index) queries the endpoint for one
+    location and updates the nodes.  extra and fields are what query
+    passes to the API, so the planner can find the cached response.
+"""
+class Source:
+    __slots__ = ('name', 'endpoint', 'query', 'extra', 'fields')
+
+    def __init__(self, name, endpoint, query, extra=None, fields=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.query = query
+        self.extra = extra
+        self.fields = fields
+
+# Run a source's query for each of the locations that share a Location
+def query_all(query, force, indexes):
+    for index in indexes:
+        query(force, index)
+
+class CyclePlanner:
+    def __init__(self, scheduler, units='M'):
+        self.scheduler = scheduler
+        self.units = units
+        self.planned = {}       # job name -> (endpoint, index) of the last plan
+
+    # Location indexes grouped by Location, in order of first use
+    def group(self, locations):
+        groups = {}
+        for (index, location) in enumerate(locations):
+            groups.setdefault(location, []).append(index)
+        return groups
+
+    """
+        Returns the (name, function, arguments) jobs for the fetch
+        engine.  api is used to check the cached responses.
+    """
+    def plan(self, api, sources, locations, force=False):
+        groups = self.group(locations)
+        jobs = []
+        self.planned = {}
+        fresh = 0
+        for source in sources:
+            for location in groups:
+                indexes = groups[location]
+                if not force and api.fresh(source.endpoint, location, self.units,
+                                           source.extra, source.fields):
+                    fresh += 1
+                    continue
+                if not self.scheduler.due(source.endpoint, indexes[0], force):
+                    continue
+                name = source.name + ' ' + str(indexes[0])
+                self.planned[name] = (source.endpoint, indexes[0])
+                jobs.append((name, query_all, (source.query, force, indexes)))
+        if fresh > 0:
+            LOGGER.debug('%d queries skipped, cached data is still fresh' % fresh)
+        return jobs
+
+    # A planned job wasn't started, free its scheduler slot
+    def release(self, name):
+        if name in self.planned:
+            (endpoint, index) = self.planned.pop(name)
+            self.scheduler.release(endpoint, index)
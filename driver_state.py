@@ -0,0 +1,67 @@
+"""
+    Last known good driver values.
+
+    The values each node last published are saved so that after a
+    restart they can be published again right away, instead of every
+    driver reading 0 until the first query completes.  The file is only
+    rewritten when something has changed.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import os
+import json
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+class DriverState:
+    def __init__(self, path):
+        self.path = path
+        self.last = None
+        self.lock = threading.Lock()
+
+    # Returns {address: {driver: [value, uom, time]}}
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+            LOGGER.debug('Loaded saved values for %d nodes' % len(state))
+            return state
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            LOGGER.warning('Failed to load saved driver values: ' + str(e))
+        return {}
+
+    def save(self, nodes):
+        state = {}
+        for address in nodes:
+            published = nodes[address].__dict__.get('published')
+            if published:
+                state[address] = dict(published)
+
+        text = json.dumps(state, sort_keys=True)
+        with self.lock:
+            if text == self.last:
+                return
+            tmp = self.path + '.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    f.write(text)
+                os.replace(tmp, self.path)
+                self.last = text
+            except Exception as e:
+                LOGGER.warning('Failed to save driver values: ' + str(e))
+
+    def remove(self):
+        with self.lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                LOGGER.warning('Failed to remove saved driver values: ' + str(e))
+            self.last = None
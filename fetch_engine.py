@@ -0,0 +1,175 @@
+"""
+    Concurrent fetch engine.
+
+    Each job is a callable that queries one WeatherBit endpoint and
+    updates the nodes that depend on it.  Jobs run on a small thread
+    pool so that all the endpoints needed for a cycle are in flight at
+    the same time and a slow response for one endpoint doesn't hold up
+    the others.
+
+    A job that is still queued or running isn't started again, and the
+    number of jobs waiting is limited.  After shutdown() jobs that
+    haven't started yet are dropped.
+
+    The poll cycles themselves run on a PollWorker thread so that
+    Polyglot's callback thread only has to queue a tick.  Ticks that
+    arrive while a cycle is still running are merged into one.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+LOGGER = polyinterface.LOGGER
+
+WORKERS = 4
+MAX_PENDING = 64       # jobs queued or running, until set_max_pending()
+CYCLE_TIMEOUT = 120    # seconds a poll cycle waits for its jobs
+STOP_TIMEOUT = 30      # seconds to wait for the running cycle on stop
+
+class FetchEngine:
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING):
+        self.pool = ThreadPoolExecutor(max_workers=workers,
+                                       thread_name_prefix='fetch')
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.active = set()
+        self.stopped = False
+
+    # Room for every job of a full cycle
+    def set_max_pending(self, max_pending):
+        with self.lock:
+            self.max_pending = max(max_pending, 1)
+
+    def _run(self, name, func, args):
+        try:
+            if not self.stopped:
+                func(*args)
+        except Exception as e:
+            LOGGER.exception('Fetch job ' + name + ' failed: ' + str(e))
+        finally:
+            with self.lock:
+                self.active.discard(name)
+
+    """
+        Start a job and return immediately.  Returns None if the job
+        wasn't started because the same job is already queued or
+        running, the queue is full or the engine has been shut down.
+    """
+    def submit(self, name, func, *args):
+        with self.lock:
+            if self.stopped:
+                return None
+            if name in self.active:
+                LOGGER.debug('Fetch job ' + name + ' is already running')
+                return None
+            if len(self.active) >= self.max_pending:
+                LOGGER.warning('Too many fetch jobs waiting, skipping ' + name)
+                return None
+            self.active.add(name)
+        try:
+            return self.pool.submit(self._run, name, func, args)
+        except RuntimeError:
+            with self.lock:
+                self.active.discard(name)
+            return None
+
+    """
+        Start all jobs at once and wait for them to finish.
+
+        jobs is a list of (name, function, arguments) tuples.  on_skip
+        is called with the name of each job that wasn't started.
+    """
+    def run(self, jobs, timeout=None, on_skip=None):
+        futures = []
+        for (name, func, args) in jobs:
+            future = self.submit(name, func, *args)
+            if future is not None:
+                futures.append(future)
+            elif on_skip is not None:
+                on_skip(name)
+        wait(futures, timeout)
+
+    def shutdown(self):
+        with self.lock:
+            self.stopped = True
+        self.pool.shutdown(wait=False)
+
+"""
+    Runs poll cycles on its own thread.  cycle(name, force, work,
+    sources) is called for each tick.  At most one tick waits while a
+    cycle is running, later ticks are merged into it.
+
+    sources limits a cycle to the named data sources, None is a full
+    poll.  A merged tick is a full poll if any of its ticks was.
+"""
+class PollWorker:
+    def __init__(self, cycle):
+        self.cycle = cycle
+        self.condition = threading.Condition()
+        self.pending = None     # [name, force, work, sources] of the next cycle
+        self.stopped = False
+        self.coalesced = 0
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._loop, name='poll', daemon=True)
+        self.thread.start()
+
+    # Queue a cycle, returns immediately.
+    def tick(self, name, force=False, *work, sources=None):
+        with self.condition:
+            if self.stopped:
+                return
+            if self.pending is None:
+                self.pending = [name, force, list(work),
+                                None if sources is None else set(sources)]
+            else:
+                LOGGER.debug('Poll cycle still running, merging ' + name)
+                self.coalesced += 1
+                self.pending[1] = self.pending[1] or force
+                for func in work:
+                    if func not in self.pending[2]:
+                        self.pending[2].append(func)
+                if sources is None:
+                    self.pending[0] = name
+                    self.pending[3] = None
+                elif self.pending[3] is not None:
+                    self.pending[3].update(sources)
+            self.condition.notify()
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                (name, force, work, sources) = self.pending
+                self.pending = None
+            try:
+                self.cycle(name, force, work, sources)
+            except Exception as e:
+                LOGGER.exception('Poll cycle ' + name + ' failed: ' + str(e))
+
+    # Drop any waiting cycle, the running one is left to finish.
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.pending = None
+            self.condition.notify()
+
+    # Wait for the running cycle to finish.  Returns False if it didn't
+    # in time.
+    def join(self, timeout=STOP_TIMEOUT):
+        thread = self.thread
+        if thread is None or thread is threading.current_thread():
+            return True
+        thread.join(timeout)
+        return not thread.is_alive()
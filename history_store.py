@@ -0,0 +1,230 @@
+"""
+    Local time series store for observations and daily ETo.
+
+    Each series is an append only file of fixed size binary records.
+    Records are buffered and written in batches, and the file is
+    compacted to the retention limit once it grows to twice that size.
+    Observations are stored under the time they were made and only
+    once, however often the same one is returned.
+    Reading unpacks the records straight from an mmap of the file, the
+    file contents aren't copied into memory first.
+
+    Daily records (ETo and rain) may be written more than once for the
+    same day as the forecast for today changes, the last one wins.  The
+    totals over the last N days are kept up to date as records are
+    added so they never need to be recalculated from the file.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import os
+import mmap
+import time
+import struct
+import datetime
+import hashlib
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+# Observation fields stored, after the timestamp
+OBS_FIELDS = ('temp', 'rh', 'pres', 'wind_spd', 'precip', 'solar_rad', 'clouds')
+OBS_FORMAT = struct.Struct('<q' + 'd' * len(OBS_FIELDS))
+DAY_FORMAT = struct.Struct('<qdd')   # date ordinal, ETo, rain
+
+# Fields of the history/daily records needed to calculate ETo
+DAILY_FIELDS = ('ts', 'datetime', 'max_temp', 'min_temp', 'rh', 'wind_spd', 'precip')
+
+OBS_RETENTION = 30 * 24 * 12    # 30 days of 5 minute observations
+DAY_RETENTION = 400
+BATCH = 12                      # records buffered before writing
+
+class SeriesFile:
+    def __init__(self, path, record, retention, batch=BATCH):
+        self.path = path
+        self.record = record
+        self.retention = retention
+        self.batch = batch
+        self.pending = []
+        try:
+            self.count = os.path.getsize(path) // record.size
+        except OSError:
+            self.count = 0
+
+    def append(self, values):
+        self.pending.append(self.record.pack(*values))
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        try:
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(self.pending))
+            self.count += len(self.pending)
+            self.pending = []
+        except OSError as e:
+            LOGGER.warning('Failed to write ' + self.path + ': ' + str(e))
+            return
+
+        if self.count > self.retention * 2:
+            self.compact()
+
+    # All records, oldest first, including those not yet written.
+    def read(self):
+        records = []
+        try:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                size -= size % self.record.size
+                if size > 0:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                        with memoryview(m)[0:size] as view:
+                            records = list(self.record.iter_unpack(view))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            LOGGER.warning('Failed to read ' + self.path + ': ' + str(e))
+        for p in self.pending:
+            records.append(self.record.unpack(p))
+        return records
+
+    # The newest record, None if there are none
+    def last(self):
+        if self.pending:
+            return self.record.unpack(self.pending[-1])
+        try:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                size -= size % self.record.size
+                if size == 0:
+                    return None
+                f.seek(size - self.record.size)
+                return self.record.unpack(f.read(self.record.size))
+        except FileNotFoundError:
+            pass
+        except (OSError, struct.error) as e:
+            LOGGER.warning('Failed to read ' + self.path + ': ' + str(e))
+        return None
+
+    # Keep only the newest retention records
+    def compact(self, records=None):
+        if records is None:
+            records = self.read()
+        records = records[-self.retention:]
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(b''.join([self.record.pack(*r) for r in records]))
+            os.replace(tmp, self.path)
+            self.count = len(records)
+            self.pending = []
+        except OSError as e:
+            LOGGER.warning('Failed to compact ' + self.path + ': ' + str(e))
+
+"""
+    Sum of a value per day over the last N days.  Replacing a day's
+    value or moving the window forward only adjusts the running sum.
+"""
+class RollingTotal:
+    def __init__(self, days):
+        self.days = days
+        self.values = {}
+        self.total = 0.0
+        self.first = None   # first day in the window
+
+    def _expire(self, today):
+        first = today - self.days + 1
+        if self.first is None:
+            self.first = first
+        while self.first < first:
+            self.total -= self.values.pop(self.first, 0.0)
+            self.first += 1
+
+    def set(self, day, value, today):
+        self._expire(today)
+        if day < self.first or day > today:
+            return
+        self.total += value - self.values.get(day, 0.0)
+        self.values[day] = value
+
+    def get(self, today):
+        self._expire(today)
+        return self.total
+
+    def missing(self, today):
+        self._expire(today)
+        return [d for d in range(self.first, today + 1) if d not in self.values]
+
+class HistoryStore:
+    def __init__(self, directory, location, days=7):
+        name = hashlib.md5(location.encode('utf-8')).hexdigest()[0:12]
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.observations = SeriesFile(os.path.join(directory, name + '-obs.bin'),
+                                       OBS_FORMAT, OBS_RETENTION)
+        self.daily = SeriesFile(os.path.join(directory, name + '-day.bin'),
+                                DAY_FORMAT, DAY_RETENTION)
+        self.et0 = RollingTotal(days)
+        self.rain = RollingTotal(days)
+        last = self.observations.last()
+        self.last_observation = last[0] if last is not None else 0
+
+        today = datetime.date.today().toordinal()
+        for (day, et0, rain) in self.daily.read():
+            self.et0.set(day, et0, today)
+            self.rain.set(day, rain, today)
+
+    """
+        Store an observation under its own time, ob['ts'] unless ts is
+        given.  The same observation is returned until the next one is
+        made, it is only stored once.  Returns False if it was already.
+    """
+    def add_observation(self, ob, ts=None):
+        if ts is None:
+            ts = ob.get('ts') or time.time()
+        ts = int(ts)
+        values = [ts]
+        for f in OBS_FIELDS:
+            try:
+                values.append(float(ob[f]))
+            except (KeyError, TypeError, ValueError):
+                values.append(float('nan'))
+        with self.lock:
+            if ts <= self.last_observation:
+                return False
+            self.last_observation = ts
+            self.observations.append(values)
+        return True
+
+    # ETo and rain, in mm, for the date given as YYYY-MM-DD
+    def add_day(self, date, et0, rain):
+        day = datetime.datetime.strptime(date[0:10], '%Y-%m-%d').toordinal()
+        today = datetime.date.today().toordinal()
+        rain = float(rain or 0.0)
+        with self.lock:
+            self.daily.append((day, float(et0), rain))
+            self.et0.set(day, float(et0), today)
+            self.rain.set(day, rain, today)
+
+    # Returns (ETo total, rain total, rain deficit) over the last N days
+    def totals(self):
+        today = datetime.date.today().toordinal()
+        with self.lock:
+            et0 = self.et0.get(today)
+            rain = self.rain.get(today)
+        return (et0, rain, et0 - rain)
+
+    # Dates in the window that have no data
+    def missing_days(self):
+        today = datetime.date.today().toordinal()
+        with self.lock:
+            return [datetime.date.fromordinal(d) for d in self.et0.missing(today)]
+
+    def flush(self):
+        with self.lock:
+            self.observations.flush()
+            self.daily.flush()
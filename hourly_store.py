@@ -0,0 +1,107 @@
+"""
+    Rolling storage for hourly forecast data.
+
+    The hourly forecast can be up to 240 records.  Instead of keeping a
+    list of dicts, each field is kept in a fixed size array of floats
+    indexed by hour, as a ring buffer.  When newer hours arrive the
+    window moves forward and only the hours that fall off the front are
+    cleared, nothing is rebuilt.
+
+    Summaries (high/low, totals, maximums) are calculated for the next
+    N hours from the arrays.
+"""
+
+import time
+from array import array
+
+HOUR = 3600
+
+# Fields of the hourly forecast records that are stored
+FIELDS = ('temp', 'rh', 'precip', 'snow', 'pop', 'wind_spd', 'wind_gust_spd', 'clouds')
+
+class HourlyWindow:
+    __slots__ = ('capacity', 'start', 'head', 'hours', 'columns')
+
+    def __init__(self, capacity=240):
+        self.capacity = capacity
+        self.start = None     # timestamp of the hour in slot head
+        self.head = 0
+        # timestamp of each slot, 0 if the slot is empty
+        self.hours = array('q', [0] * capacity)
+        self.columns = {f: array('d', [0.0] * capacity) for f in FIELDS}
+
+    def _clear(self, slot):
+        self.hours[slot] = 0
+        for f in FIELDS:
+            self.columns[f][slot] = 0.0
+
+    # Move the start of the window forward to the hour containing ts
+    def advance(self, ts):
+        hour = int(ts) - int(ts) % HOUR
+        if self.start is None:
+            self.start = hour
+            return
+        shift = (hour - self.start) // HOUR
+        if shift <= 0:
+            return
+        for i in range(0, min(shift, self.capacity)):
+            self._clear((self.head + i) % self.capacity)
+        self.head = (self.head + shift) % self.capacity
+        self.start = hour
+
+    # Store one hourly forecast record
+    def add(self, record):
+        ts = int(record['ts'])
+        hour = ts - ts % HOUR
+        if self.start is None:
+            self.advance(hour)
+
+        offset = (hour - self.start) // HOUR
+        if offset < 0:
+            return  # already in the past
+        if offset >= self.capacity:
+            self.advance(hour - (self.capacity - 1) * HOUR)
+            offset = self.capacity - 1
+
+        slot = (self.head + offset) % self.capacity
+        self.hours[slot] = hour
+        for f in FIELDS:
+            value = record.get(f)
+            self.columns[f][slot] = float(value) if value is not None else 0.0
+
+    # Slots for the next count hours that have data
+    def _slots(self, count, now):
+        self.advance(now)
+        slots = []
+        for i in range(0, min(count, self.capacity)):
+            slot = (self.head + i) % self.capacity
+            if self.hours[slot] != 0:
+                slots.append(slot)
+        return slots
+
+    """
+        Summary of the next count hours.  Returns None if there's no
+        data for that period.
+    """
+    def summary(self, count, now=None):
+        if self.start is None:
+            return None
+        if now is None:
+            now = time.time()
+        slots = self._slots(count, now)
+        if not slots:
+            return None
+
+        c = self.columns
+        return {
+                'hours': len(slots),
+                'max_temp': max([c['temp'][s] for s in slots]),
+                'min_temp': min([c['temp'][s] for s in slots]),
+                'rh': sum([c['rh'][s] for s in slots]) / len(slots),
+                'precip': sum([c['precip'][s] for s in slots]),
+                'snow': sum([c['snow'][s] for s in slots]),
+                'pop': max([c['pop'][s] for s in slots]),
+                'wind_spd': max([c['wind_spd'][s] for s in slots]),
+                'wind_gust_spd': max([c['wind_gust_spd'][s] for s in slots]),
+                'clouds': sum([c['clouds'][s] for s in slots]) / len(slots),
+                }
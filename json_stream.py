@@ -0,0 +1,176 @@
+"""
+    Incremental decoder for WeatherBit responses.
+
+    WeatherBit responses are an object with the records in a 'data'
+    array.  The decoder is fed the response text as it arrives and
+    hands each record to a callback as soon as it has been parsed, so
+    the nodes can be updated before the rest of the response is
+    downloaded.  Only the requested fields of each record are kept.
+
+    The other members of the top level object are kept as is.
+"""
+
+import json
+
+_decoder = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+NUMBER = '0123456789.eE+-'     # characters a number can continue with
+
+# Parser states
+START = 0
+KEY = 1
+VALUE = 2
+ARRAY = 3
+ITEM = 4
+DONE = 5
+
+class StreamDecoder:
+    def __init__(self, array_key='data', fields=None, on_record=None):
+        self.array_key = array_key
+        self.fields = fields
+        self.on_record = on_record
+        self.result = {}
+        self.records = []
+        self.buf = ''
+        self.pos = 0
+        self.state = START
+        self.key = None
+
+    # Skip white space, returns False if more data is needed.
+    def _skip(self):
+        while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+            self.pos += 1
+        return self.pos < len(self.buf)
+
+    """
+        Decode the JSON value at the current position.  A value is only
+        complete once one of the characters in ends follows it.  A
+        number cut off by the end of a chunk decodes as a shorter number
+        (35. as 35), the rest of it is still to come.
+    """
+    def _value(self, ends=',}]'):
+        try:
+            (value, end) = _decoder.raw_decode(self.buf, self.pos)
+        except json.JSONDecodeError:
+            return (False, None)
+        while end < len(self.buf) and self.buf[end] in WHITESPACE:
+            end += 1
+        if end >= len(self.buf):
+            return (False, None)
+        if self.buf[end] not in ends:
+            if self.buf[end] in NUMBER:
+                return (False, None)
+            raise ValueError('Unexpected ' + repr(self.buf[end]) + ' after ' + repr(value))
+        self.pos = end
+        return (True, value)
+
+    def _project(self, record):
+        if self.fields is None or not isinstance(record, dict):
+            return record
+        return {f: record[f] for f in self.fields if f in record}
+
+    def feed(self, text):
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+
+        while self.state != DONE and self._skip():
+            c = self.buf[self.pos]
+
+            if self.state == START:
+                if c != '{':
+                    raise ValueError('Response is not a JSON object')
+                self.pos += 1
+                self.state = KEY
+
+            elif self.state == KEY:
+                if c == '}':
+                    self.pos += 1
+                    self.state = DONE
+                    break
+                if c == ',':
+                    self.pos += 1
+                    continue
+                (ok, key) = self._value(':')
+                if not ok:
+                    break
+                self.pos += 1
+                self.key = key
+                self.state = ARRAY if key == self.array_key else VALUE
+
+            elif self.state == ARRAY:
+                if c == '[':
+                    self.pos += 1
+                    self.state = ITEM
+                else:
+                    self.state = VALUE
+
+            elif self.state == VALUE:
+                (ok, value) = self._value()
+                if not ok:
+                    break
+                self.result[self.key] = value
+                self.state = KEY
+
+            elif self.state == ITEM:
+                if c == ']':
+                    self.pos += 1
+                    self.result[self.array_key] = self.records
+                    self.state = KEY
+                    continue
+                if c == ',':
+                    self.pos += 1
+                    continue
+                (ok, record) = self._value()
+                if not ok:
+                    break
+                record = self._project(record)
+                self.records.append(record)
+                if self.on_record is not None:
+                    self.on_record(len(self.records) - 1, record)
+
+    # All the text has been fed, return the decoded object.
+    def close(self):
+        self.feed('')
+        if self.state != DONE:
+            raise ValueError('Incomplete JSON response')
+        return self.result
+
+# Pass each record of an already decoded response to the callback
+def replay(jdata, on_record, array_key='data'):
+    if on_record is None or array_key not in jdata:
+        return
+    for (index, record) in enumerate(jdata[array_key]):
+        on_record(index, record)
+
+
+if __name__ == '__main__':
+    import os
+    import random
+
+    # Splitting a response anywhere, also inside numbers right after
+    # the '.', 'e' or '-', has to give the same result as json.loads.
+    fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'fixtures')
+    text = '{"lat": -35.78e0, "lon": 78.64, "data": [{"a": 1.5E-3, "b": [1, -2]}, {"a": 0}], "n": null}'
+    expected = json.loads(text)
+    for split in range(0, len(text) + 1):
+        decoder = StreamDecoder()
+        decoder.feed(text[0:split])
+        decoder.feed(text[split:])
+        assert decoder.close() == expected, split
+    print("every split decoded")
+
+    rand = random.Random(1)
+    for name in sorted(os.listdir(fixtures)):
+        with open(os.path.join(fixtures, name)) as f:
+            text = f.read()
+        expected = json.loads(text)
+        array_key = 'alerts' if 'alerts' in expected else 'data'
+        for i in range(0, 200):
+            decoder = StreamDecoder(array_key=array_key)
+            pos = 0
+            while pos < len(text):
+                size = rand.randint(1, 64)
+                decoder.feed(text[pos:pos + size])
+                pos += size
+            assert decoder.close() == expected, name
+    print("random chunks decoded")
@@ -0,0 +1,247 @@
+"""
+    Counters, gauges and latency histograms for the node server.
+
+    The API queries, the query/publish paths and the ETo calculation
+    record into the shared REGISTRY.  The values can be written as a
+    Prometheus text file and/or served on a local port for scraping,
+    and a few of them are reported by the controller node.
+
+    Recording is cheap since it's done for every driver update.  Hot
+    paths get a Counter from the registry once and count with it, so
+    the counter isn't looked up each time.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import os
+import time
+import bisect
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LOGGER = polyinterface.LOGGER
+
+# Latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# A counter that can be incremented from any thread, the count is
+# updated under the registry lock.
+class Counter:
+    __slots__ = ('lock', 'count')
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.count = 0
+
+    def inc(self, value=1):
+        with self.lock:
+            self.count += value
+
+    def value(self):
+        return self.count
+
+class Timer:
+    __slots__ = ('registry', 'name', 'labels', 'start')
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+# Value of a counter or gauge
+def number(value):
+    if isinstance(value, Counter):
+        return value.value()
+    return value
+
+def format_labels(labels, extra=None):
+    pairs = list(labels)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(['%s="%s"' % (k, str(v).replace('"', '\\"')) for (k, v) in pairs]) + '}'
+
+"""
+    Labels are passed as a tuple of (name, value) pairs so they can be
+    used as part of the key without building anything.
+"""
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.help = {}
+        self.values = {}      # (name, labels) -> number or Histogram
+
+    def describe(self, name, kind, text):
+        self.kinds[name] = kind
+        self.help[name] = text
+
+    # The counter for name and labels, created if needed
+    def counter(self, name, labels=()):
+        key = (name, labels)
+        with self.lock:
+            c = self.values.get(key)
+            if c is None:
+                c = Counter(self.lock)
+                self.values[key] = c
+        return c
+
+    def inc(self, name, labels=(), value=1):
+        self.counter(name, labels).inc(value)
+
+    def set(self, name, value, labels=()):
+        with self.lock:
+            self.values[(name, labels)] = value
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self.lock:
+            h = self.values.get(key)
+            if h is None:
+                h = Histogram()
+                self.values[key] = h
+            h.observe(value)
+
+    def timer(self, name, labels=()):
+        return Timer(self, name, labels)
+
+    # Current value of a counter or gauge, summed over all label sets
+    # matching the given labels.
+    def total(self, name, labels=()):
+        total = 0
+        with self.lock:
+            for (n, l) in self.values:
+                if n == name and set(labels) <= set(l):
+                    total += number(self.values[(n, l)])
+        return total
+
+    # (count, sum) of a histogram, summed over all matching label sets
+    def summary(self, name, labels=()):
+        count = 0
+        total = 0.0
+        with self.lock:
+            for (n, l) in self.values:
+                if n == name and set(labels) <= set(l):
+                    count += self.values[(n, l)].count
+                    total += self.values[(n, l)].sum
+        return (count, total)
+
+    # Prometheus text exposition format
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items(), key=lambda i: (i[0][0], i[0][1]))
+            lines = []
+            last = None
+            for ((name, labels), value) in items:
+                kind = self.kinds.get(name, GAUGE)
+                if name != last:
+                    if name in self.help:
+                        lines.append('# HELP %s %s' % (name, self.help[name]))
+                    lines.append('# TYPE %s %s' % (name, kind))
+                    last = name
+                if kind == HISTOGRAM:
+                    cumulative = 0
+                    for (bound, count) in zip(BUCKETS, value.counts):
+                        cumulative += count
+                        lines.append('%s_bucket%s %d' % (name, format_labels(labels, ('le', repr(bound))), cumulative))
+                    lines.append('%s_bucket%s %d' % (name, format_labels(labels, ('le', '+Inf')), value.count))
+                    lines.append('%s_sum%s %r' % (name, format_labels(labels), value.sum))
+                    lines.append('%s_count%s %d' % (name, format_labels(labels), value.count))
+                else:
+                    lines.append('%s%s %r' % (name, format_labels(labels), number(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                f.write(self.render())
+            os.replace(tmp, path)
+        except Exception as e:
+            LOGGER.warning('Failed to write metrics to ' + path + ': ' + str(e))
+
+# Decorator that records the time taken by each call
+def timed(name, labels=(), registry=None):
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            with (registry or REGISTRY).timer(name, labels):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+REGISTRY = Registry()
+REGISTRY.describe('weatherbit_api_requests_total', COUNTER, 'WeatherBit API queries by endpoint and result, cached if answered from the response cache')
+REGISTRY.describe('weatherbit_api_request_seconds', HISTOGRAM, 'Time until the WeatherBit API responds, calls to the service only')
+REGISTRY.describe('weatherbit_query_seconds', HISTOGRAM, 'Time to query and publish, by query')
+REGISTRY.describe('weatherbit_driver_updates_total', COUNTER, 'Driver updates sent or suppressed by the deadband')
+REGISTRY.describe('weatherbit_driver_messages_total', COUNTER, 'Driver values sent to Polyglot after batching')
+REGISTRY.describe('weatherbit_et0_seconds', HISTOGRAM, 'Time to calculate ETo for a forecast')
+REGISTRY.describe('weatherbit_last_success_timestamp', GAUGE, 'Time of the last good query by query and location')
+
+# Serve the registry on a local port for Prometheus to scrape
+class MetricsServer:
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self.server = None
+
+    def start(self, port, host=''):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.stop()
+        try:
+            self.server = ThreadingHTTPServer((host, port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True,
+                             name='metrics').start()
+            LOGGER.info('Serving metrics on port %d' % port)
+        except Exception as e:
+            LOGGER.error('Failed to start metrics server on port %d: %s' % (port, str(e)))
+            self.server = None
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
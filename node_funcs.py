@@ -6,10 +6,35 @@ try:
     import polyinterface
 except ImportError:
     import pgc_interface as polyinterface
+import time
+import metrics
 
 
 LOGGER = polyinterface.LOGGER
 
+# Changes smaller than this are not sent to the ISY.  Drivers not
+# listed here are sent whenever the value changes.  Each node class
+# has its own table in its deadband attribute, this one is for the
+# weather nodes.
+DEADBAND = {
+        'CLITEMP': 0.2,  # temperature
+        'DEWPT': 0.2,    # dew point
+        'GV0': 0.2,      # high temp
+        'GV1': 0.2,      # low temp
+        'GV2': 0.2,      # feels like
+        'BARPRES': 0.5,  # pressure
+        'GV10': 2.0,     # ozone
+        }
+
+# Send the value anyway if it hasn't been sent for this many seconds.
+# Set to None to disable the periodic refresh.
+DEADBAND_MAX_AGE = 3600
+
+SENT = (('result', 'sent'),)
+SENT_COUNTER = metrics.REGISTRY.counter('weatherbit_driver_updates_total', SENT)
+SUPPRESSED_COUNTER = metrics.REGISTRY.counter('weatherbit_driver_updates_total',
+                                              (('result', 'suppressed'),))
+
 def add_functions_as_methods(functions):
     def decorator(Class):
         for function in functions:
@@ -18,14 +43,93 @@ def add_functions_as_methods(functions):
     return decorator
 
 # Wrap all the setDriver calls so that we can check that the 
-# value exist first.
+# value exist first.  Values are metric and converted to the node's
+# units here.  Small changes are filtered by the driver's deadband
+# unless force is set.
 def update_driver(self, driver, value, force=False, prec=3):
+    if 'published' not in self.__dict__:
+        self.published = {}
+
     try:
-        self.setDriver(driver, round(float(value), prec), True, force, self.uom[driver])
-        LOGGER.debug('setDriver (%s, %f)' %(driver, float(value)))
+        value = float(value)
+        if driver in self.conversions:
+            value = self.conversions[driver](value)
+        value = round(value, prec)
+        if not force:
+            if refresh_due(self, driver):
+                force = True
+            elif not deadband_exceeded(self, driver, value):
+                SUPPRESSED_COUNTER.inc()
+                return
+        # During a poll cycle the update is held and sent with the rest
+        # of the cycle's updates.
+        batch = getattr(self.controller, 'batch', None)
+        if batch is None or not batch.add(self, driver, value, force, self.uom[driver]):
+            self.setDriver(driver, value, True, force, self.uom[driver])
+        self.published[driver] = (value, self.uom[driver], time.time())
+        SENT_COUNTER.inc()
+        LOGGER.debug('setDriver (%s, %f)' %(driver, value))
     except:
         LOGGER.warning('Missing data for driver ' + driver)
 
+# Has it been too long since the driver was last sent?
+def refresh_due(self, driver):
+    if DEADBAND_MAX_AGE is None or driver not in self.published:
+        return False
+    return time.time() - self.published[driver][2] >= DEADBAND_MAX_AGE
+
+def deadband_exceeded(self, driver, value):
+    if driver not in self.published:
+        return True
+
+    (last, last_uom, when) = self.published[driver]
+    if last_uom != self.uom[driver]:
+        return True
+    if driver in self.deadband:
+        return abs(value - last) >= self.deadband[driver]
+    return value != last
+
+# Publish driver values saved before a restart.  Values saved with
+# different units are skipped, they'll be sent by the next query.
+def restore_drivers(self, drivers):
+    if 'published' not in self.__dict__:
+        self.published = {}
+
+    for driver in drivers:
+        (value, uom, when) = drivers[driver]
+        if driver not in self.uom or self.uom[driver] != uom:
+            continue
+        self.setDriver(driver, value, True, True, uom)
+        self.published[driver] = (value, uom, when)
+
+# Fields of the observation record used by update_conditions
+CONDITION_FIELDS = ('ts', 'temp', 'rh', 'pres', 'wind_spd', 'wind_dir', 'vis',
+                    'precip', 'dewpt', 'app_temp', 'solar_rad', 'uv', 'aqi',
+                    'clouds', 'weather')
+
+# Update the current condition drivers from a WeatherBit observation
+# record.  Used by both the controller and the current condition nodes.
+def update_conditions(self, ob, force=False):
+    self.update_driver('CLITEMP', ob['temp'], force)
+    self.update_driver('CLIHUM', ob['rh'], force)
+    self.update_driver('BARPRES', ob['pres'], force)
+    self.update_driver('GV4', ob['wind_spd'], force)
+    self.update_driver('WINDDIR', ob['wind_dir'], force)
+    self.update_driver('GV15', ob['vis'], force)
+    self.update_driver('GV6', ob['precip'], force)
+    self.update_driver('DEWPT', ob['dewpt'], force)
+    self.update_driver('GV2', ob['app_temp'], force)
+    self.update_driver('SOLRAD', ob['solar_rad'], force)
+    self.update_driver('GV16', ob['uv'], force, 1)
+    self.update_driver('GV17', ob['aqi'], force)
+    self.update_driver('GV14', ob['clouds'], force)
+
+    # Weather conditions:
+    #  ob['weather'][code]
+    weather = ob['weather']['code']
+    LOGGER.debug('**>>> WeatherCoded = ' + str(weather))
+    self.update_driver('GV13', weather, force)
+
 def get_saved_log_level(self):
     if 'customData' in self.polyConfig:
         if 'level' in self.polyConfig['customData']:
@@ -39,4 +143,4 @@ def save_log_level(self, level):
             }
     self.poly.saveCustomData(level_data)
 
-functions = (update_driver, get_saved_log_level, save_log_level)
+functions = (update_driver, restore_drivers, update_conditions, get_saved_log_level, save_log_level)
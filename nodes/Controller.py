@@ -10,23 +10,51 @@ except ImportError:
     import pgc_interface as polyinterface
 import sys
 import time
+import logging
+import threading
 import datetime
-import requests
 import socket
 import math
 import re
 import json
 from nodes import weatherbit_daily
+from nodes import weatherbit_current
+from nodes import weatherbit_hourly
+from nodes import weatherbit_airquality
+from nodes import weatherbit_alerts
 from weather_funcs import *
 import ns_parameters
 import node_funcs
+import weatherbit_api
+import fetch_engine
+import scheduler
+import cycle_planner
+import alert_index
+import hourly_store
+import history_store
+import driver_state
+import circuit_breaker
+import metrics
+import profiler
+import publish_batch
 
 LOGGER = polyinterface.LOGGER
 
+# WeatherBit endpoint for each kind of query
+ENDPOINTS = {
+        'conditions': 'current',
+        'forecast': 'forecast/daily',
+        'hourly': 'forecast/hourly',
+        'airquality': 'current/airquality',
+        'aq_forecast': 'forecast/airquality',
+        'alerts': 'alerts',
+        }
+
 @node_funcs.add_functions_as_methods(node_funcs.functions)
 class Controller(polyinterface.Controller):
     id = 'weather'
     hint = [0,0,0,0]
+    deadband = node_funcs.DEADBAND
 
     def __init__(self, polyglot):
         super(Controller, self).__init__(polyglot)
@@ -35,6 +63,29 @@ class Controller(polyinterface.Controller):
         self.primary = self.address
         self.configured = False
         self.uom = {}
+        self.conversions = {}
+        self.units = None
+        self.deleted = set()
+        self.locations = []
+        self.hourly = {}
+        self.history = {}
+        self.history_lock = threading.Lock()
+        self.scheduler = scheduler.PollScheduler()
+        self.api = weatherbit_api.WeatherBitAPI(cache_file='response_cache.json',
+                                                scheduler=self.scheduler)
+        self.engine = fetch_engine.FetchEngine()
+        self.poller = fetch_engine.PollWorker(self.run_cycle)
+        self.planner = cycle_planner.CyclePlanner(self.scheduler)
+        self.alerts = {}        # location index -> AlertIndex
+        self.storms = set()     # locations with a storm nearby
+        self.fast_alerts = alert_index.FastPoll(lambda: self.poller.tick('alerts', sources=('alerts',)))
+        self.state = driver_state.DriverState('driver_state.json')
+        self.stale = set()
+        self.health = circuit_breaker.HEALTHY
+        self.metrics_server = metrics.MetricsServer()
+        self.last_metrics = (0, 0.0, 0)
+        self.profiler = profiler.CycleProfiler()
+        self.batch = publish_batch.PublishBatch()
 
         self.params = ns_parameters.NSParameters([{
             'name': 'APIkey',
@@ -47,12 +98,14 @@ class Controller(polyinterface.Controller):
             'default': 'set me',
             'isRequired': True,
             'notice': 'WeatherBit Location must be set',
+            'type': ns_parameters.string_list,
             },
             {
             'name': 'Elevation',
             'default': '0',
             'isRequired': False,
             'notice': '',
+            'type': ns_parameters.float_list,
             },
             {
             'name': 'Units',
@@ -65,17 +118,151 @@ class Controller(polyinterface.Controller):
             'default': '0',
             'isRequired': False,
             'notice': '',
+            'type': int,
+            },
+            {
+            'name': 'Forecast Hours',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            'type': int,
+            },
+            {
+            'name': 'Hourly Summary',
+            'default': '1;6;24',
+            'isRequired': False,
+            'notice': '',
+            'type': ns_parameters.int_list,
+            },
+            {
+            'name': 'History Days',
+            'default': '7',
+            'isRequired': False,
+            'notice': '',
+            'type': int,
+            },
+            {
+            'name': 'Air Quality',
+            'default': 'false',
+            'isRequired': False,
+            'notice': '',
+            'type': ns_parameters.boolean,
+            },
+            {
+            'name': 'Alerts',
+            'default': 'false',
+            'isRequired': False,
+            'notice': '',
+            'type': ns_parameters.boolean,
             },
             {
             'name': 'Plant Type',
             'default': '0.23',
             'isRequired': False,
             'notice': '',
+            'type': float,
+            },
+            {
+            'name': 'API URL',
+            'default': weatherbit_api.BASE_URL,
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Daily Calls',
+            'default': str(scheduler.DEFAULT_BUDGET),
+            'isRequired': False,
+            'notice': '',
+            'type': int,
+            },
+            {
+            'name': 'Metrics File',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Metrics Port',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            'type': int,
+            },
+            {
+            'name': 'Metrics Drivers',
+            'default': 'false',
+            'isRequired': False,
+            'notice': '',
+            'type': ns_parameters.boolean,
             },
             ])
 
+        # Things that depend on the parameters are updated when they change
+        self.params.subscribe(self.location_changed, ('Location',))
+        self.params.subscribe(self.history_changed, ('Location', 'History Days'))
+        self.params.subscribe(self.alerts_changed, ('Location', 'Alerts'))
+        self.params.subscribe(self.api_changed, ('APIkey', 'Location', 'API URL'))
+        self.params.subscribe(self.units_changed, ('Units',))
+        self.params.subscribe(self.et_changed, ('Elevation', 'Plant Type'))
+        self.params.subscribe(self.budget_changed, ('Location', 'Daily Calls', 'Forecast Days', 'Forecast Hours',
+                                                    'Air Quality', 'Alerts'))
+        self.params.subscribe(self.metrics_changed, ('Metrics Port',))
+
         self.poly.onConfig(self.process_config)
 
+    def location_changed(self, cfg):
+        self.locations = list(cfg['Location'])
+        self.hourly = {}
+        for index in list(self.stale):
+            if index >= len(self.locations):
+                self.mark_fresh(index)
+
+    # The stores are opened again, with the new window, when next used.
+    def history_changed(self, cfg):
+        self.flush_history()
+        self.history = {}
+
+    # Start over with the alerts, at the normal polling rate
+    def alerts_changed(self, cfg):
+        self.alerts = {}
+        self.storms = set()
+        for index in self.fast_alerts.active():
+            self.fast_alerts.set(index, False)
+            self.scheduler.set_fast(ENDPOINTS['alerts'], index, None)
+
+    def api_changed(self, cfg):
+        self.api.reset()
+        self.api.set_base_url(cfg['API URL'])
+
+    # Locations that are the same are only queried once.  The fetch
+    # engine has to take a job for every source and location, plus a
+    # history backfill for each location.
+    def budget_changed(self, cfg):
+        endpoints = [source.endpoint for source in self.sources(cfg)]
+        self.scheduler.configure(cfg['Daily Calls'], len(set(self.locations)), endpoints)
+        self.engine.set_max_pending(len(self.locations) * (len(endpoints) + 1))
+
+    def metrics_changed(self, cfg):
+        if cfg['Metrics Port'] > 0:
+            self.metrics_server.start(cfg['Metrics Port'])
+        else:
+            self.metrics_server.stop()
+
+    # The data is always metric, so a unit change only needs the cached
+    # data to be published again.
+    def units_changed(self, cfg):
+        if not self.configured:
+            return
+        self.set_driver_uom(cfg['Units'])
+        self.poller.tick('units', True)
+
+    # The forecast hasn't changed but ETo has, so the skip check is
+    # bypassed to calculate it again.
+    def et_changed(self, cfg):
+        if not self.configured:
+            return
+        self.poller.tick('eto', True)
+
     # Process changes to customParameters
     def process_config(self, config):
         (valid, changed) = self.params.update_from_polyglot(config)
@@ -87,8 +274,7 @@ class Controller(polyinterface.Controller):
             LOGGER.debug('-- configuration is valid')
             self.removeNoticesAll()
             self.configured = True
-            if self.params.isSet('Forecast Days'):
-                self.discover()
+            self.discover()
         elif valid:
             LOGGER.debug('-- configuration not changed, but is valid')
             # is this necessary
@@ -98,56 +284,242 @@ class Controller(polyinterface.Controller):
         LOGGER.info('Starting node server')
         self.set_logging_level()
         self.check_params()
+        cfg = self.params.snapshot()
+        self.location_changed(cfg)
+        self.api_changed(cfg)
+        self.budget_changed(cfg)
+        self.metrics_changed(cfg)
         self.discover()
+        self.restore_state()
 
         LOGGER.info('Node server started')
 
-        # Do an initial query to get filled in as soon as possible
-        self.query_conditions(True)
-        self.query_forecast(True)
+        # Do an initial query to get filled in as soon as possible.
+        # All endpoints for all locations are queried at the same time,
+        # in the background.
+        self.poller.start()
+        self.poller.tick('start', True)
 
+    # Both polls just queue a cycle on the poll worker, the cycle checks
+    # with the scheduler for queries that are due.
     def longPoll(self):
-        self.query_forecast(False)
+        self.poller.tick('longPoll', False, self.flush_history)
 
     def shortPoll(self):
-        self.query_conditions(False)
+        self.poller.tick('shortPoll')
 
-    def get_weather_data(self, url_param, extra=None):
-        request = 'http://api.weatherbit.io/v2.0/'
-        request += url_param
-        request += '?' + self.params.get('Location')
-        request += '&key=' + self.params.get('APIkey')
-        request += '&units=' + self.params.get('Units')
+    """
+        One poll cycle, run on the poll worker thread.  The cycle waits
+        for its queries to finish (up to CYCLE_TIMEOUT) so that polls
+        that come in while it's running are merged into the next cycle.
+        The driver updates from all the cycle's jobs are sent together
+        once the jobs are done.
+
+        sources limits the cycle to those data sources, i.e. the fast
+        alert polls.  Only full polls save the state and the metrics.
+    """
+    def run_cycle(self, name, force, work, sources=None):
+        self.batch.open()
+        try:
+            if self.profiler.enabled:
+                cycle = self.profiler.cycle(name)
+                jobs = cycle.call(self.poll_cycle, force, work, sources)
+                jobs = [(job, cycle.wrap(func), args) for (job, func, args) in jobs]
+                self.engine.run(jobs, fetch_engine.CYCLE_TIMEOUT, self.planner.release)
+                cycle.call(self.batch.flush)
+                cycle.close()
+            else:
+                self.engine.run(self.poll_cycle(force, work, sources), fetch_engine.CYCLE_TIMEOUT,
+                                self.planner.release)
+        finally:
+            self.batch.flush()
+
+    # The work done by the poll itself, returns the fetch jobs to start
+    def poll_cycle(self, force, work, sources=None):
+        if sources is None:
+            self.save_state()
+            self.export_metrics()
+        for func in work:
+            func()
+        return self.cycle_jobs(force, sources)
+
+    # All nodes, including the controller, by address
+    def all_nodes(self):
+        nodes = dict(self.nodes)
+        nodes[self.address] = self
+        return nodes
+
+    def save_state(self):
+        self.state.save(self.all_nodes())
 
-        if extra != None:
-            request += extra
+    """
+        Write the metrics file and, if enabled, publish the API time,
+        failures, driver updates since the last poll and the age of the
+        current conditions.
+    """
+    def export_metrics(self):
+        cfg = self.params.snapshot()
+        if cfg['Metrics File'] != '':
+            metrics.REGISTRY.write(cfg['Metrics File'])
 
-        LOGGER.debug('request = %s' % request)
+        if not cfg['Metrics Drivers']:
+            return
 
-        try:
-            c = requests.get(request)
-            jdata = c.json()
-            c.close()
+        registry = metrics.REGISTRY
+        (count, total) = registry.summary('weatherbit_api_request_seconds')
+        updates = registry.total('weatherbit_driver_updates_total', node_funcs.SENT)
+        (last_count, last_total, last_updates) = self.last_metrics
+        self.last_metrics = (count, total, updates)
+
+        if count > last_count:
+            self.setDriver('GV26', round((total - last_total) / (count - last_count) * 1000, 1))
+        self.setDriver('GV27', registry.total('weatherbit_api_requests_total', (('result', 'error'),)) +
+                       registry.total('weatherbit_api_requests_total', (('result', 'stale'),)))
+        self.setDriver('GV28', updates - last_updates)
+        last = registry.total('weatherbit_last_success_timestamp',
+                              (('query', 'conditions'), ('location', '0')))
+        if last > 0:
+            self.setDriver('GV29', int(time.time() - last))
+
+    """
+        Publish the values saved before the restart.  They are flagged
+        as stale until each location's current conditions have been
+        queried again.
+    """
+    def restore_state(self):
+        state = self.state.load()
+        nodes = self.all_nodes()
+        for address in state:
+            if address in nodes:
+                nodes[address].restore_drivers(state[address])
+
+        if len(state) > 0:
+            self.stale = set(range(0, len(self.locations)))
+            self.setDriver('GV24', 1, True, True)
+
+    """
+        Record the time of a good query.  Data served from the cache
+        because the query failed doesn't count.  Returns False for that.
+    """
+    def record_success(self, query, index, jdata):
+        if weatherbit_api.is_stale(jdata):
+            return False
+        metrics.REGISTRY.set('weatherbit_last_success_timestamp', time.time(),
+                             (('query', query), ('location', str(index))))
+        return True
+
+    def mark_fresh(self, index):
+        if index in self.stale:
+            self.stale.discard(index)
+            if len(self.stale) == 0:
+                self.setDriver('GV24', 0, True, True)
+
+    # All the queries that are due for all locations
+    def cycle_jobs(self, force, names=None):
+        sources = self.sources(self.params.snapshot())
+        if names is not None:
+            sources = [s for s in sources if s.name in names]
+        return self.planner.plan(self.api, sources, self.locations, force)
 
-            LOGGER.debug(jdata)
-        except:
-            LOGGER.error('HTTP request failed for ' + url_param)
+    """
+        The data sources that are enabled.  The extra parameters and
+        fields must match what the query passes to get_weather_data.
+    """
+    def sources(self, cfg):
+        Source = cycle_planner.Source
+        sources = [Source('conditions', ENDPOINTS['conditions'], self.query_conditions,
+                          None, node_funcs.CONDITION_FIELDS)]
+        if cfg['Forecast Days'] > 0:
+            sources.append(Source('forecast', ENDPOINTS['forecast'], self.query_forecast,
+                                  {'days': cfg['Forecast Days']}, weatherbit_daily.FIELDS))
+        if cfg['Forecast Hours'] > 0:
+            sources.append(Source('hourly', ENDPOINTS['hourly'], self.query_hourly,
+                                  {'hours': min(cfg['Forecast Hours'], 240)},
+                                  ('ts',) + hourly_store.FIELDS))
+        if cfg['Air Quality']:
+            sources.append(Source('airquality', ENDPOINTS['airquality'], self.query_airquality,
+                                  None, weatherbit_airquality.CURRENT_FIELDS))
+            sources.append(Source('aq_forecast', ENDPOINTS['aq_forecast'], self.query_aq_forecast,
+                                  None, weatherbit_airquality.FORECAST_FIELDS))
+        if cfg['Alerts']:
+            sources.append(Source('alerts', ENDPOINTS['alerts'], self.query_alerts))
+        return sources
+
+    """
+        The first location is reported by the controller and forecast_N
+        nodes. Additional locations get their own current conditions
+        node and forecast nodes.
+    """
+    def current_address(self, index):
+        if index == 0:
+            return self.address
+        return 'current_' + str(index)
+
+    def forecast_address(self, index, day):
+        if index == 0:
+            return 'forecast_' + str(day)
+        return 'forecast_' + str(index) + '_' + str(day)
+
+    def airquality_address(self, index):
+        return 'airquality_' + str(index)
+
+    def alerts_address(self, index):
+        return 'alerts_' + str(index)
+
+    def hourly_address(self, index, hours):
+        if index == 0:
+            return 'hourly_' + str(hours)
+        return 'hourly_' + str(index) + '_' + str(hours)
+
+    # Per location elevation, if only one is given it's used for all.
+    def elevation(self, cfg, index):
+        elevations = cfg['Elevation']
+        if len(elevations) == 0:
+            return 0.0
+        if index < len(elevations):
+            return elevations[index]
+        return elevations[0]
+
+    def get_weather_data(self, url_param, location, extra=None, fields=None, on_record=None):
+        cfg = self.params.snapshot()
+        try:
+            jdata = self.api.get(url_param,
+                                 location,
+                                 cfg['APIkey'],
+                                 'M',
+                                 extra,
+                                 fields,
+                                 on_record)
+
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                LOGGER.debug(jdata)
+        except circuit_breaker.CircuitOpenError as e:
+            LOGGER.info('Skipping ' + url_param + ' query: ' + str(e))
+            jdata = {}
+        except Exception as e:
+            LOGGER.error('HTTP request failed for ' + url_param + ': ' + str(e))
             jdata = {}
 
+        health = self.api.breaker.health()
+        if health != self.health:
+            self.health = health
+            self.setDriver('GV25', health)
         return jdata
 
     """
         Query the weather service for the current conditions and update
         the current condition node values.
     """
-    def query_conditions(self, force):
+    @metrics.timed('weatherbit_query_seconds', (('query', 'conditions'),))
+    def query_conditions(self, force, index=0):
 
 
         if not self.configured:
             LOGGER.info('Skipping connection because we aren\'t configured yet.')
             return
 
-        jdata = self.get_weather_data('current')
+        jdata = self.get_weather_data('current', self.locations[index],
+                                      fields=node_funcs.CONDITION_FIELDS)
 
         # Should we check that jdata actually has something in it?
         if jdata == None:
@@ -160,89 +532,352 @@ class Controller(polyinterface.Controller):
 
         ob = jdata['data'][0] # Only use first observation record
 
-        self.update_driver('CLITEMP', ob['temp'], force)
-        self.update_driver('CLIHUM', ob['rh'], force)
-        self.update_driver('BARPRES', ob['pres'], force)
-        self.update_driver('GV4', ob['wind_spd'], force)
-        self.update_driver('WINDDIR', ob['wind_dir'], force)
-        self.update_driver('GV15', ob['vis'], force)
-        self.update_driver('GV6', ob['precip'], force)
-        self.update_driver('DEWPT', ob['dewpt'], force)
-        self.update_driver('GV2', ob['app_temp'], force)
-        self.update_driver('SOLRAD', ob['solar_rad'], force)
-        self.update_driver('GV16', ob['uv'], force, 1)
-        self.update_driver('GV17', ob['aqi'], force)
-        self.update_driver('GV14', ob['clouds'], force)
-
-        # Weather conditions:
-        #  ob['weather'][code]
-        weather = ob['weather']['code']
-        LOGGER.debug('**>>> WeatherCoded = ' + str(weather))
-        self.update_driver('GV13', weather, force)
+        if index == 0:
+            self.update_conditions(ob, force)
+        else:
+            self.nodes[self.current_address(index)].update_conditions(ob, force)
+
+        # The values are only fresh if they came from the service
+        if self.record_success('conditions', index, jdata):
+            self.mark_fresh(index)
+
+        if alert_index.storm_near(ob['weather']['code']):
+            self.storms.add(index)
+        else:
+            self.storms.discard(index)
+        self.update_alert_rate(index)
+
+        # Cached data on a failed query is an observation already stored
+        store = self.history_store(index)
+        if store is not None and not weatherbit_api.is_stale(jdata):
+            store.add_observation(ob)
 
     # TODO: Move query_forecast to the daily node file
-    def query_forecast(self, force):
+    @metrics.timed('weatherbit_query_seconds', (('query', 'forecast'),))
+    def query_forecast(self, force, index=0):
         # daily forecasts
 
-        days = '&days=' + self.params.get('Forecast Days')
+        cfg = self.params.snapshot()
+        days = cfg['Forecast Days']
 
         if days == 0:  # skip if no forecast days defined.
             return
 
-        jdata = self.get_weather_data('forecast/daily', days)
+        if not self.configured:
+            LOGGER.info('Skipping connection because we aren\'t configured yet.')
+            return
+
+        # Each day's node is updated as soon as that day has been parsed.
+        # Days that haven't changed since the last query are skipped.
+        # first day is today, is that OK
+        changed = []
+        def update_day(day, f_obs):
+            LOGGER.debug('forecast for date ' + f_obs['valid_date'])
+            if self.nodes[self.forecast_address(index, day)].update_forecast(f_obs, force):
+                changed.append(day)
+
+        jdata = self.get_weather_data('forecast/daily', self.locations[index],
+                                      {'days': days},
+                                      weatherbit_daily.FIELDS, update_day)
+
+        if 'data' not in jdata:
+            LOGGER.error('No response object in query response.')
+            return
+
+        self.record_success('forecast', index, jdata)
+
+        if len(changed) < len(jdata['data']):
+            LOGGER.debug('%d of %d forecast days unchanged' %
+                         (len(jdata['data']) - len(changed), len(jdata['data'])))
+        if len(changed) == 0:
+            return
+
+        # ETo for all the changed days is calculated at once
+        with metrics.REGISTRY.timer('weatherbit_et0_seconds'):
+            et0 = weatherbit_daily.forecast_et0([jdata['data'][d] for d in changed],
+                                                self.elevation(cfg, index),
+                                                cfg['Plant Type'],
+                                                float(jdata['lat']))
+
+        for (i, day) in enumerate(changed):
+            self.nodes[self.forecast_address(index, day)].update_et0(float(et0[i]))
+
+        # Today's ETo and rain are kept, the last forecast of the day is
+        # what ends up in the history.
+        store = self.history_store(index)
+        if store is not None:
+            if changed[0] == 0:
+                today = jdata['data'][0]
+                store.add_day(today['valid_date'], float(et0[0]), today['precip'])
+            self.update_water_balance(index, force)
+
+    """
+        Fill in the days missing from the ETo history from the WeatherBit
+        history/daily endpoint.  This needs a paid WeatherBit plan so it's
+        only done when requested with the backfill command.
+    """
+    def query_history(self, force, index=0):
+        if not self.configured:
+            LOGGER.info('Skipping connection because we aren\'t configured yet.')
+            return
+
+        store = self.history_store(index)
+        if store is None:
+            return
+
+        missing = store.missing_days()
+        if len(missing) == 0:
+            LOGGER.info('ETo history for location ' + str(index) + ' is complete')
+            return
+
+        # end_date isn't included in the results
+        start = min(missing)
+        end = max(missing) + datetime.timedelta(days=1)
+        jdata = self.get_weather_data('history/daily', self.locations[index],
+                                      {'start_date': start.strftime('%Y-%m-%d'),
+                                       'end_date': end.strftime('%Y-%m-%d')},
+                                      history_store.DAILY_FIELDS)
+
+        if 'data' not in jdata or len(jdata['data']) == 0:
+            LOGGER.error('No response object in history query response.')
+            return
+
+        cfg = self.params.snapshot()
+        with metrics.REGISTRY.timer('weatherbit_et0_seconds'):
+            et0 = weatherbit_daily.forecast_et0(jdata['data'],
+                                                self.elevation(cfg, index),
+                                                cfg['Plant Type'],
+                                                float(jdata['lat']))
+        for day in range(0, len(jdata['data'])):
+            record = jdata['data'][day]
+            store.add_day(record['datetime'], float(et0[day]), record['precip'])
+        store.flush()
+        self.update_water_balance(index, force)
+
+    # ETo history store for the location, None if history is disabled
+    def history_store(self, index):
+        with self.history_lock:
+            store = self.history.get(index)
+            if store is None:
+                days = self.params.snapshot()['History Days']
+                if days <= 0:
+                    return None
+                try:
+                    store = history_store.HistoryStore('history', self.locations[index], days)
+                except Exception as e:
+                    LOGGER.error('Failed to open history store: ' + str(e))
+                    return None
+                self.history[index] = store
+            return store
+
+    def flush_history(self):
+        for index in list(self.history):
+            self.history[index].flush()
+
+    # ETo total and rain deficit over the history window
+    def update_water_balance(self, index, force=False):
+        (et0, rain, deficit) = self.history[index].totals()
+        if index == 0:
+            node = self
+        else:
+            node = self.nodes.get(self.current_address(index))
+        if node is not None:
+            node.update_driver('GV22', et0, force)
+            node.update_driver('GV23', deficit, force)
+
+    """
+        Query the hourly forecast.  The hours are kept in a rolling
+        window per location and only the summaries for the next N hours
+        are published.
+    """
+    @metrics.timed('weatherbit_query_seconds', (('query', 'hourly'),))
+    def query_hourly(self, force, index=0):
+        cfg = self.params.snapshot()
+        hours = cfg['Forecast Hours']
+
+        if hours == 0:  # skip if hourly forecast isn't enabled.
+            return
 
         if not self.configured:
             LOGGER.info('Skipping connection because we aren\'t configured yet.')
             return
 
+        window = self.hourly.get(index)
+        if window is None:
+            window = hourly_store.HourlyWindow()
+            self.hourly[index] = window
+
+        jdata = self.get_weather_data('forecast/hourly', self.locations[index],
+                                      {'hours': min(hours, 240)},
+                                      ('ts',) + hourly_store.FIELDS,
+                                      lambda hour, f_obs: window.add(f_obs))
+
         if 'data' not in jdata:
             LOGGER.error('No response object in query response.')
             return
 
-        day = 0
-        # first day is today, is that OK
-        for f_obs in jdata['data']:
-            LOGGER.debug('forecast for date ' + f_obs['valid_date'])
-            address = 'forecast_' + str(day)
-            self.nodes[address].update_forecast(f_obs, float(self.params.get('Elevation')), float(self.params.get('Plant Type')), float(jdata['lat']))
-            day += 1
+        for count in cfg['Hourly Summary']:
+            summary = window.summary(count)
+            address = self.hourly_address(index, count)
+            if summary is not None and address in self.nodes:
+                self.nodes[address].update_summary(summary, force)
+
+    # Current pollutant and pollen levels
+    @metrics.timed('weatherbit_query_seconds', (('query', 'airquality'),))
+    def query_airquality(self, force, index=0):
+        node = self.nodes.get(self.airquality_address(index))
+        if node is None or not self.configured:
+            return
+
+        jdata = self.get_weather_data('current/airquality', self.locations[index],
+                                      fields=weatherbit_airquality.CURRENT_FIELDS)
+        if 'data' not in jdata or len(jdata['data']) == 0:
+            LOGGER.error('No response object in air quality response.')
+            return
+
+        node.update_current(jdata['data'][0], force)
+        self.record_success('airquality', index, jdata)
 
+    # Highest AQI forecast over the next few days
+    @metrics.timed('weatherbit_query_seconds', (('query', 'aq_forecast'),))
+    def query_aq_forecast(self, force, index=0):
+        node = self.nodes.get(self.airquality_address(index))
+        if node is None or not self.configured:
+            return
+
+        jdata = self.get_weather_data('forecast/airquality', self.locations[index],
+                                      fields=weatherbit_airquality.FORECAST_FIELDS)
+        if 'data' not in jdata:
+            LOGGER.error('No response object in air quality forecast response.')
+            return
+
+        node.update_forecast(weatherbit_airquality.forecast_peaks(jdata['data'], time.time()), force)
+        self.record_success('aq_forecast', index, jdata)
+
+    # Severe weather alerts for the location
+    @metrics.timed('weatherbit_query_seconds', (('query', 'alerts'),))
+    def query_alerts(self, force, index=0):
+        node = self.nodes.get(self.alerts_address(index))
+        if node is None or not self.configured:
+            return
+
+        jdata = self.get_weather_data('alerts', self.locations[index])
+        if 'alerts' not in jdata:
+            LOGGER.error('No alerts in alerts response.')
+            return
+        self.record_success('alerts', index, jdata)
+
+        # Only new, changed or expired alerts update the node
+        alerts = self.alerts.setdefault(index, alert_index.AlertIndex())
+        (new, changed, expired) = alerts.update(jdata['alerts'])
+        if new or changed or expired or force:
+            node.update_alerts(alerts.active(), [alerts.get(a) for a in new],
+                               [alerts.get(a) for a in changed], force)
+        self.update_alert_rate(index)
+
+    """
+        Poll a location's alerts quickly while it has alerts or a storm
+        nearby, at the normal rate otherwise.
+    """
+    def update_alert_rate(self, index):
+        if not self.params.snapshot()['Alerts']:
+            return
+        alerts = self.alerts.get(index)
+        fast = index in self.storms or (alerts is not None and len(alerts.active()) > 0)
+        if self.fast_alerts.set(index, fast):
+            LOGGER.info('%s alerts for location %d' % ('Fast polling' if fast else 'Normal polling', index))
+            self.scheduler.set_fast(ENDPOINTS['alerts'], index,
+                                    alert_index.FAST_INTERVAL if fast else None)
 
     def query(self):
         for node in self.nodes:
             self.nodes[node].reportDrivers()
 
-    def discover(self, *args, **kwargs):
-        num_days = int(self.params.get('Forecast Days'))
-        LOGGER.info('Creating nodes for %d days of forecast data' % num_days);
+    # Nodes that discover creates, by address.  (class, title) for each.
+    def wanted_nodes(self, cfg):
+        num_days = cfg['Forecast Days']
+        summaries = cfg['Hourly Summary'] if cfg['Forecast Hours'] > 0 else ()
+        wanted = {}
+        for index in range(0, len(self.locations)):
+            prefix = ''
+            if index > 0:
+                prefix = 'Location ' + str(index) + ' '
+                wanted[self.current_address(index)] = (weatherbit_current.ConditionsNode,
+                                                       prefix + 'Current')
+            for day in range(0, num_days):
+                wanted[self.forecast_address(index, day)] = (weatherbit_daily.DailyNode,
+                                                             prefix + 'Forecast ' + str(day))
+            for count in summaries:
+                wanted[self.hourly_address(index, count)] = (weatherbit_hourly.HourlyNode,
+                                                             prefix + 'Next ' + str(count) + ' Hours')
+            if cfg['Air Quality']:
+                wanted[self.airquality_address(index)] = (weatherbit_airquality.AirQualityNode,
+                                                          prefix + 'Air Quality')
+            if cfg['Alerts']:
+                wanted[self.alerts_address(index)] = (weatherbit_alerts.AlertsNode,
+                                                      prefix + 'Alerts')
+        return wanted
 
-        if num_days < 16:
-            # if less than 16 days should we try to delete extras?
-            for day in range(num_days, 16):
-                address = 'forecast_' + str(day)
-                try:
-                    self.delNode(address)
-                except:
-                    LOGGER.debug('Failed to delete node ' + address)
+    """
+        Bring the nodes in line with the configuration.  Only nodes
+        that are no longer wanted are deleted and only missing nodes are
+        created, so a configuration change that doesn't change the nodes
+        doesn't send anything to Polyglot.  Nodes Polyglot has from an
+        earlier run are created again, since we need the node objects.
+    """
+    def discover(self, *args, **kwargs):
+        cfg = self.params.snapshot()
+        wanted = self.wanted_nodes(cfg)
+
+        if self.units != cfg['Units']:
+            self.set_driver_uom(cfg['Units'])
+
+        # Polyglot's node list isn't updated until it sends a new config
+        existing = set(self.nodes)
+        for node in self.polyConfig.get('nodes', []):
+            if 'address' in node and node['address'] not in self.deleted:
+                existing.add(node['address'])
+
+        removed = [a for a in existing if a not in wanted and
+                   a.split('_')[0] + '_' in ('current_', 'forecast_', 'hourly_', 'airquality_', 'alerts_')]
+        added = [a for a in wanted if a not in self.nodes]
+        LOGGER.info('Discover: %d locations, adding %d nodes, removing %d nodes' %
+                    (len(self.locations), len(added), len(removed)))
+
+        for address in sorted(removed):
+            self.deleted.add(address)
+            try:
+                self.delNode(address)
+            except:
+                LOGGER.debug('Failed to delete node ' + address)
 
-        for day in range(0, num_days):
-            address = 'forecast_' + str(day)
-            title = 'Forecast ' + str(day)
+        for address in added:
+            (node_class, title) = wanted[address]
+            self.deleted.discard(address)
             try:
-                node = weatherbit_daily.DailyNode(self, self.address, address, title)
+                node = node_class(self, self.address, address, title)
+                node.set_driver_uom(cfg['Units'])
                 self.addNode(node)
             except:
-                LOGGER.error('Failed to create forecast node ' + title)
-
-        self.set_driver_uom(self.params.get('Units'))
-
+                LOGGER.error('Failed to create node ' + title)
 
     # Delete the node server from Polyglot
     def delete(self):
         LOGGER.info('Removing node server')
+        self.state.remove()
 
     def stop(self):
         LOGGER.info('Stopping node server')
+        self.fast_alerts.stop()
+        self.poller.stop()
+        self.engine.shutdown()
+        # The state is saved and the session closed after the last cycle
+        if not self.poller.join():
+            LOGGER.warning('Poll cycle still running, stopping anyway')
+        self.metrics_server.stop()
+        self.save_state()
+        self.flush_history()
+        self.api.close()
 
     def update_profile(self, command):
         st = self.poly.installprofile()
@@ -256,7 +891,7 @@ class Controller(polyinterface.Controller):
         if self.params.get_from_polyglot(self):
             LOGGER.debug('All required parameters are set!')
             self.configured = True
-            if int(self.params.get('Forecast Days')) > 16:
+            if self.params.snapshot()['Forecast Days'] > 16:
                 addNotice('Number of days of forecast data limited to 16 days', 'forecast')
                 self.params.set('Forcast Days', 16)
         else:
@@ -269,9 +904,15 @@ class Controller(polyinterface.Controller):
     def set_driver_uom(self, units):
         LOGGER.info('New Configure driver units to ' + units)
         self.uom =  uom.get_uom(units)
-        for day in range(0,int(self.params.get('Forecast Days'))):
-            address = 'forecast_' + str(day)
-            self.nodes[address].set_driver_uom(units)
+        self.conversions = uom.get_conversions(units)
+        self.units = units
+        for address in self.wanted_nodes(self.params.snapshot()):
+            if address in self.nodes:
+                self.nodes[address].set_driver_uom(units)
+
+    def backfill(self, command):
+        for index in range(0, len(self.locations)):
+            self.engine.submit('history ' + str(index), self.query_history, True, index)
 
     def remove_notices_all(self, command):
         self.removeNoticesAll()
@@ -297,10 +938,25 @@ class Controller(polyinterface.Controller):
         LOGGER.setLevel(level)
 
 
+    # Turn profiling of the poll cycles on or off
+    def set_profiling(self, command):
+        enabled = int(command['value']) != 0
+        self.profiler.enable(enabled)
+        self.setDriver('GV30', 1 if enabled else 0, True, True)
+
+    def dump_profile(self, command):
+        try:
+            self.profiler.dump('profiles')
+        except Exception as e:
+            LOGGER.error('Failed to write profile: ' + str(e))
+
     commands = {
             'UPDATE_PROFILE': update_profile,
             'REMOVE_NOTICES_ALL': remove_notices_all,
             'DEBUG': set_logging_level,
+            'BACKFILL': backfill,
+            'PROFILE': set_profiling,
+            'PROFILE_DUMP': dump_profile,
             }
 
     # For this node server, all of the info is available in the single
@@ -321,6 +977,15 @@ class Controller(polyinterface.Controller):
             {'driver': 'GV16', 'value': 0, 'uom': 71},     # uv
             {'driver': 'GV17', 'value': 0, 'uom': 56},     # air quality
             {'driver': 'SOLRAD', 'value': 0, 'uom': 74},   # solar radiataion
+            {'driver': 'GV22', 'value': 0, 'uom': 82},     # ETo total
+            {'driver': 'GV23', 'value': 0, 'uom': 82},     # rain deficit
+            {'driver': 'GV24', 'value': 0, 'uom': 2},      # saved values are stale
+            {'driver': 'GV25', 'value': 0, 'uom': 25},     # WeatherBit API health
+            {'driver': 'GV26', 'value': 0, 'uom': 42},     # average API query time
+            {'driver': 'GV27', 'value': 0, 'uom': 56},     # failed API queries
+            {'driver': 'GV28', 'value': 0, 'uom': 56},     # driver updates since last poll
+            {'driver': 'GV29', 'value': 0, 'uom': 58},     # age of current conditions
+            {'driver': 'GV30', 'value': 0, 'uom': 2},      # profiling poll cycles
             {'driver': 'GV21', 'value': 0, 'uom': 25},     # log level
             ]
 
@@ -0,0 +1,110 @@
+# Node definition for an air quality node.  Current pollutant and
+# pollen levels from current/airquality and the highest AQI expected
+# over the next 24 and 72 hours from forecast/airquality.
+
+CLOUD = False
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+    CLOUD = True
+
+import node_funcs
+
+LOGGER = polyinterface.LOGGER
+
+# Fields used from the current/airquality record
+CURRENT_FIELDS = ('aqi', 'pm25', 'pm10', 'o3', 'no2', 'so2', 'co',
+                  'pollen_level_tree', 'pollen_level_grass',
+                  'pollen_level_weed', 'mold_level')
+
+# Fields used from the forecast/airquality records
+FORECAST_FIELDS = ('ts', 'aqi')
+
+# Air quality values don't depend on the units setting
+UOM = {
+        'GV0': 56,      # AQI
+        'GV1': 56,      # PM2.5
+        'GV2': 56,      # PM10
+        'GV3': 56,      # ozone
+        'GV4': 56,      # nitrogen dioxide
+        'GV5': 56,      # sulfur dioxide
+        'GV6': 56,      # carbon monoxide
+        'GV7': 25,      # tree pollen
+        'GV8': 25,      # grass pollen
+        'GV9': 25,      # weed pollen
+        'GV10': 25,     # mold
+        'GV11': 56,     # max AQI next 24 hours
+        'GV12': 56,     # max AQI next 72 hours
+        }
+
+# Pollutant concentrations move around a little between readings.  The
+# AQI and the pollen and mold levels are sent on every change.
+DEADBAND = {
+        'GV1': 0.5,     # PM2.5
+        'GV2': 1.0,     # PM10
+        'GV3': 2.0,     # ozone
+        'GV4': 1.0,     # nitrogen dioxide
+        'GV5': 1.0,     # sulfur dioxide
+        'GV6': 10.0,    # carbon monoxide
+        }
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class AirQualityNode(polyinterface.Node):
+    id = 'airquality'
+    drivers = [
+            {'driver': 'GV0', 'value': 0, 'uom': 56},
+            {'driver': 'GV1', 'value': 0, 'uom': 56},
+            {'driver': 'GV2', 'value': 0, 'uom': 56},
+            {'driver': 'GV3', 'value': 0, 'uom': 56},
+            {'driver': 'GV4', 'value': 0, 'uom': 56},
+            {'driver': 'GV5', 'value': 0, 'uom': 56},
+            {'driver': 'GV6', 'value': 0, 'uom': 56},
+            {'driver': 'GV7', 'value': 0, 'uom': 25},
+            {'driver': 'GV8', 'value': 0, 'uom': 25},
+            {'driver': 'GV9', 'value': 0, 'uom': 25},
+            {'driver': 'GV10', 'value': 0, 'uom': 25},
+            {'driver': 'GV11', 'value': 0, 'uom': 56},
+            {'driver': 'GV12', 'value': 0, 'uom': 56},
+            ]
+    uom = UOM
+    conversions = {}
+    deadband = DEADBAND
+
+    def set_driver_uom(self, units):
+        self.units = units
+
+    def update_current(self, ob, force=False):
+        self.update_driver('GV0', ob['aqi'], force, 0)
+        self.update_driver('GV1', ob['pm25'], force, 1)
+        self.update_driver('GV2', ob['pm10'], force, 1)
+        self.update_driver('GV3', ob['o3'], force, 1)
+        self.update_driver('GV4', ob['no2'], force, 1)
+        self.update_driver('GV5', ob['so2'], force, 1)
+        self.update_driver('GV6', ob['co'], force, 1)
+        self.update_driver('GV7', ob['pollen_level_tree'], force, 0)
+        self.update_driver('GV8', ob['pollen_level_grass'], force, 0)
+        self.update_driver('GV9', ob['pollen_level_weed'], force, 0)
+        self.update_driver('GV10', ob['mold_level'], force, 0)
+
+    # peaks is (max AQI over the next 24 hours, over the next 72 hours)
+    def update_forecast(self, peaks, force=False):
+        self.update_driver('GV11', peaks[0], force, 0)
+        self.update_driver('GV12', peaks[1], force, 0)
+
+"""
+    Highest AQI in the next 24 and 72 hours of the forecast/airquality
+    records.  Hours that have already passed are ignored.
+"""
+def forecast_peaks(records, now):
+    day = 0
+    three_days = 0
+    for r in records:
+        ts = int(r['ts'])
+        if ts + 3600 <= now or r.get('aqi') is None:
+            continue
+        if ts < now + 86400:
+            day = max(day, r['aqi'])
+        if ts < now + 3 * 86400:
+            three_days = max(three_days, r['aqi'])
+    return (day, three_days)
@@ -0,0 +1,62 @@
+# Node definition for a weather alerts node.  Reports the severe
+# weather alerts issued for the location by the WeatherBit alerts
+# endpoint.
+
+CLOUD = False
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+    CLOUD = True
+
+import node_funcs
+
+LOGGER = polyinterface.LOGGER
+
+# Alert severity, from least to most severe
+SEVERITY = {
+        'Advisory': 1,
+        'Watch': 2,
+        'Warning': 3,
+        }
+
+UOM = {
+        'GV0': 56,      # active alerts
+        'GV1': 25,      # highest severity
+        'GV2': 56,      # new alerts in the last update
+        'GV3': 56,      # changed alerts in the last update
+        }
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class AlertsNode(polyinterface.Node):
+    id = 'alerts'
+    drivers = [
+            {'driver': 'GV0', 'value': 0, 'uom': 56},
+            {'driver': 'GV1', 'value': 0, 'uom': 25},
+            {'driver': 'GV2', 'value': 0, 'uom': 56},
+            {'driver': 'GV3', 'value': 0, 'uom': 56},
+            ]
+    uom = UOM
+    conversions = {}
+    deadband = {}       # counts and severity are sent on every change
+
+    def set_driver_uom(self, units):
+        self.units = units
+
+    """
+        alerts are the active alerts, new and changed the alerts that
+        are new or have changed since the last update.  Only called
+        when something has changed.
+    """
+    def update_alerts(self, alerts, new=(), changed=(), force=False):
+        severity = 0
+        for alert in alerts:
+            severity = max(severity, SEVERITY.get(alert.get('severity'), 0))
+        for alert in new:
+            LOGGER.info('New alert for ' + self.name + ': ' + str(alert.get('title')))
+        for alert in changed:
+            LOGGER.info('Updated alert for ' + self.name + ': ' + str(alert.get('title')))
+        self.update_driver('GV0', len(alerts), force, 0)
+        self.update_driver('GV1', severity, force, 0)
+        self.update_driver('GV2', len(new), force, 0)
+        self.update_driver('GV3', len(changed), force, 0)
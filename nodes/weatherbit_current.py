@@ -0,0 +1,45 @@
+# Node definition for a current conditions node.  Used for the
+# additional locations, the first location's current conditions are
+# reported by the controller node.
+
+CLOUD = False
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+    CLOUD = True
+
+from weather_funcs import uom
+import node_funcs
+
+LOGGER = polyinterface.LOGGER
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class ConditionsNode(polyinterface.Node):
+    id = 'current'
+    drivers = [
+            {'driver': 'CLITEMP', 'value': 0, 'uom': 4},   # temperature
+            {'driver': 'CLIHUM', 'value': 0, 'uom': 22},   # humidity
+            {'driver': 'DEWPT', 'value': 0, 'uom': 4},     # dewpoint
+            {'driver': 'BARPRES', 'value': 0, 'uom': 117}, # pressure
+            {'driver': 'WINDDIR', 'value': 0, 'uom': 76},  # direction
+            {'driver': 'GV4', 'value': 0, 'uom': 49},      # wind speed
+            {'driver': 'GV2', 'value': 0, 'uom': 4},       # feels like
+            {'driver': 'RAINRT', 'value': 0, 'uom': 46},   # rain
+            {'driver': 'GV13', 'value': 0, 'uom': 25},     # climate conditions
+            {'driver': 'GV14', 'value': 0, 'uom': 22},     # cloud conditions
+            {'driver': 'GV15', 'value': 0, 'uom': 83},     # visibility
+            {'driver': 'GV16', 'value': 0, 'uom': 71},     # uv
+            {'driver': 'GV17', 'value': 0, 'uom': 56},     # air quality
+            {'driver': 'SOLRAD', 'value': 0, 'uom': 74},   # solar radiataion
+            {'driver': 'GV22', 'value': 0, 'uom': 82},     # ETo total
+            {'driver': 'GV23', 'value': 0, 'uom': 82},     # rain deficit
+            ]
+    uom = uom.get_uom('M')
+    conversions = {}
+    deadband = node_funcs.DEADBAND
+
+    def set_driver_uom(self, units):
+        self.uom = uom.get_uom(units)
+        self.conversions = uom.get_conversions(units)
+        self.units = units
@@ -17,6 +17,11 @@ import node_funcs
 
 LOGGER = polyinterface.LOGGER
 
+# Fields of the forecast records used for the drivers and ETo
+FIELDS = ('ts', 'valid_date', 'rh', 'pres', 'dewpt', 'max_temp', 'min_temp',
+          'clouds', 'wind_spd', 'wind_gust_spd', 'wind_dir', 'precip', 'snow',
+          'snow_depth', 'uv', 'vis', 'pop', 'ozone', 'moon_phase', 'weather')
+
 @node_funcs.add_functions_as_methods(node_funcs.functions)
 class DailyNode(polyinterface.Node):
     id = 'daily'
@@ -65,16 +70,33 @@ class DailyNode(polyinterface.Node):
             'GV9': 56,
             'WINDDIR': 76,
             }
+    conversions = {}
+    deadband = node_funcs.DEADBAND
+    fingerprint = None      # (fingerprint, time) of the last forecast applied
 
     def set_driver_uom(self, units):
         self.uom = uom.get_uom(units)
+        self.conversions = uom.get_conversions(units)
         self.units = units
 
     def mm2inch(self, mm):
         return mm/25.4
 
 
-    def update_forecast(self, forecast, elevation, plant_type, latitude):
+    """
+        Update the drivers from the forecast record.  If the record is
+        the same as the last one applied nothing is done, unless force
+        is set or the values are due to be sent again.  Returns True if
+        the drivers were updated.
+    """
+    def update_forecast(self, forecast, force=False):
+        fingerprint = forecast_fingerprint(forecast)
+        if not force and self.fingerprint is not None and \
+                self.fingerprint[0] == fingerprint and \
+                (node_funcs.DEADBAND_MAX_AGE is None or
+                 time.time() - self.fingerprint[1] < node_funcs.DEADBAND_MAX_AGE):
+            return False
+        self.fingerprint = (fingerprint, time.time())
 
         epoch = int(forecast['ts'])
         dow = time.strftime("%w", time.gmtime(epoch))
@@ -101,21 +123,37 @@ class DailyNode(polyinterface.Node):
         # pod = part of day d=day, n=night
         # forecast['weather']['code']
         self.update_driver('GV13', forecast['weather']['code'])
+        return True
 
-        # Calculate ETo
-        #  Temp is in degree C and windspeed is in m/s, we may need to
-        #  convert these.
-        J = datetime.datetime.fromtimestamp(epoch).timetuple().tm_yday
-
-        Tmin = forecast['min_temp']
-        Tmax = forecast['max_temp']
-        Ws = forecast['wind_spd']
-        if self.units != 'M':
-            LOGGER.info('Conversion of temperature/wind speed required')
-            Tmin = et3.FtoC(Tmin)
-            Tmax = et3.FtoC(Tmax)
-            Ws = et3.mph2ms(Ws)
-
-        et0 = et3.evapotranspriation(Tmax, Tmin, None, Ws, float(elevation), forecast['rh'], forecast['rh'], latitude, float(plant_type), J)
+    def update_et0(self, et0):
         self.update_driver('GV20', round(et0, 2))
         LOGGER.info("ETo = %f %f" % (et0, self.mm2inch(et0)))
+
+
+# Hash of the fields of a forecast record that the drivers and ETo use
+def forecast_fingerprint(forecast):
+    values = []
+    for f in FIELDS:
+        value = forecast.get(f)
+        if isinstance(value, dict):
+            value = value.get('code')
+        values.append(value)
+    return hash(tuple(values))
+
+"""
+    Calculate ETo for all the forecast days.
+
+    The forecast is always metric so temp is in degree C and windspeed
+    is in m/s.  For one location and one plant type the scalar function
+    is faster than et3.evapotranspriation_array(), which only pays off
+    with several crop coefficients or locations at once.
+"""
+def forecast_et0(forecasts, elevation, plant_type, latitude):
+    elevation = float(elevation)
+    plant_type = float(plant_type)
+    et0 = []
+    for f in forecasts:
+        J = datetime.datetime.fromtimestamp(int(f['ts'])).timetuple().tm_yday
+        et0.append(et3.evapotranspriation(f['max_temp'], f['min_temp'], None, f['wind_spd'],
+                                          elevation, f['rh'], f['rh'], latitude, plant_type, J))
+    return et0
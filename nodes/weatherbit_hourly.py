@@ -0,0 +1,49 @@
+# Node definition for an hourly forecast summary node.  Each node
+# summarizes the next N hours of the hourly forecast.
+
+CLOUD = False
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+    CLOUD = True
+
+from weather_funcs import uom
+import node_funcs
+
+LOGGER = polyinterface.LOGGER
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class HourlyNode(polyinterface.Node):
+    id = 'hourly'
+    drivers = [
+            {'driver': 'GV0', 'value': 0, 'uom': 4},       # high temp
+            {'driver': 'GV1', 'value': 0, 'uom': 4},       # low temp
+            {'driver': 'CLIHUM', 'value': 0, 'uom': 22},   # humidity
+            {'driver': 'GV14', 'value': 0, 'uom': 22},     # clouds
+            {'driver': 'GV4', 'value': 0, 'uom': 49},      # wind speed
+            {'driver': 'GV5', 'value': 0, 'uom': 49},      # gust speed
+            {'driver': 'GV6', 'value': 0, 'uom': 82},      # precipitation
+            {'driver': 'GV7', 'value': 0, 'uom': 82},      # snow
+            {'driver': 'GV18', 'value': 0, 'uom': 22},     # pop
+            ]
+    uom = uom.get_uom('M')
+    conversions = {}
+    deadband = node_funcs.DEADBAND
+
+    def set_driver_uom(self, units):
+        self.uom = uom.get_uom(units)
+        self.conversions = uom.get_conversions(units)
+        self.units = units
+
+    # summary is from hourly_store.HourlyWindow.summary()
+    def update_summary(self, summary, force=False):
+        self.update_driver('GV0', summary['max_temp'], force)
+        self.update_driver('GV1', summary['min_temp'], force)
+        self.update_driver('CLIHUM', summary['rh'], force, 0)
+        self.update_driver('GV14', summary['clouds'], force, 0)
+        self.update_driver('GV4', summary['wind_spd'], force)
+        self.update_driver('GV5', summary['wind_gust_spd'], force)
+        self.update_driver('GV6', summary['precip'], force)
+        self.update_driver('GV7', summary['snow'], force)
+        self.update_driver('GV18', summary['pop'], force)
@@ -15,6 +15,11 @@
         },
     ]
 
+    A parameter can also have a 'type', a function that converts the
+    string value (i.e. int, float, string_list).  snapshot() returns
+    a read only mapping of all the converted values that's only rebuilt
+    when a value changes.  Functions registered with subscribe() are
+    called with the new snapshot when one of their parameters changes.
 """
 
 try:
@@ -23,49 +28,102 @@ except ImportError:
     import pgc_interface as polyinterface
 
 
+from types import MappingProxyType
+
 LOGGER = polyinterface.LOGGER
 
+# Parameters that hold multiple values separated by ;
+def string_list(value, sep=';'):
+    return tuple([v.strip() for v in value.split(sep) if v.strip() != ''])
+
+def float_list(value, sep=';'):
+    return tuple([float(v) for v in string_list(value, sep)])
+
+def int_list(value, sep=';'):
+    return tuple([int(v) for v in string_list(value, sep)])
+
+def boolean(value):
+    return value.strip().lower() in ('true', 'yes', 'on', '1')
+
 class NSParameters:
     def __init__(self, parameters):
-        self.internal = []
+        self.internal = {}
+        self.subscribers = []
+        self._snapshot = None
 
         for p in parameters:
-            self.internal.append({
+            self.internal[p['name']] = {
                 'name': p['name'],
                 'value': '', 
                 'default': p['default'],
                 'isSet': False,
                 'isRequired': p['isRequired'],
                 'notice_msg': p['notice'],
-                })
+                'type': p.get('type', str),
+                }
 
     def set(self, name, value):
-        for p in self.internal:
-            if p['name'] == name:
-                p['value'] = value
-                p['isSet'] = True
-                return
+        if name in self.internal:
+            p = self.internal[name]
+            changed = self.get(name) != value
+            p['value'] = value
+            p['isSet'] = True
+            if changed:
+                self.changed([name])
 
     def get(self, name):
-        for p in self.internal:
-            if p['name'] == name:
-                if p['isSet']:
-                    return p['value']
-                else:
-                    return p['default']
+        if name in self.internal:
+            p = self.internal[name]
+            if p['isSet']:
+                return p['value']
+            else:
+                return p['default']
 
     def isSet(self, name):
-        for p in self.internal:
-            if p['name'] == name:
-                return p['isSet']
+        if name in self.internal:
+            return self.internal[name]['isSet']
         return False
 
+    def _convert(self, p):
+        value = p['value'] if p['isSet'] else p['default']
+        try:
+            return p['type'](value)
+        except (ValueError, TypeError):
+            LOGGER.error('Invalid value ' + str(value) + ' for ' + p['name'] + ', using default')
+            return p['type'](p['default'])
+
+    # Converted values of all parameters, rebuilt only after a change
+    def snapshot(self):
+        snap = self._snapshot
+        if snap is None:
+            snap = MappingProxyType({name: self._convert(self.internal[name])
+                                     for name in self.internal})
+            self._snapshot = snap
+        return snap
+
+    """
+        Call function(snapshot) whenever one of the named parameters
+        changes.  If names is None, any change calls it.
+    """
+    def subscribe(self, function, names=None):
+        self.subscribers.append((function, names))
+
+    def changed(self, names):
+        self._snapshot = None
+        snap = self.snapshot()
+        for (function, watch) in self.subscribers:
+            if watch is None or any(n in watch for n in names):
+                try:
+                    function(snap)
+                except Exception as e:
+                    LOGGER.error('Parameter change handler failed: ' + str(e))
+
     """
         Send notices for unconfigured parameters that are are marked
         as required.
     """
     def send_notices(self, poly):
-        for p in self.internal:
+        for p in self.internal.values():
             if not p['isSet'] and p['isRequired']:
                 if p['notice_msg'] is not None:
                     try:
@@ -82,9 +140,11 @@ class NSParameters:
     def get_from_polyglot(self, poly):
         customParams = poly.polyConfig['customParams']
         params = {}
+        changed = []
 
-        for p in self.internal:
+        for p in self.internal.values():
             LOGGER.debug('checking for ' + p['name'] + ' in customParams')
+            before = self.get(p['name'])
             if p['name'] in customParams:
                 LOGGER.debug('found ' + p['name'] + ' in customParams')
                 p['value'] = customParams[p['name']]
@@ -97,9 +157,15 @@ class NSParameters:
             else:
                 params[p['name']] = p['default']
 
+            if self.get(p['name']) != before:
+                changed.append(p['name'])
+
         poly.addCustomParam(params)            
 
-        for p in self.internal:
+        if changed:
+            self.changed(changed)
+
+        for p in self.internal.values():
             if not p['isSet'] and p['isRequired']:
                 return False
         return True
@@ -113,11 +179,13 @@ class NSParameters:
     def update_from_polyglot(self, config):
         changed = False
         valid = True
+        names = []
 
         if 'customParams' in config:
-            for p in self.internal:
+            for p in self.internal.values():
                 if p['name'] in config['customParams']:
                     poly_param = config['customParams'][p['name']]
+                    before = self.get(p['name'])
 
                     # did it change?
                     if poly_param != p['default'] and poly_param != p['value']:
@@ -128,10 +196,16 @@ class NSParameters:
                         p['value'] = poly_param
                         p['isSet'] = True
 
-        for p in self.internal:
+                    if self.get(p['name']) != before:
+                        names.append(p['name'])
+
+        for p in self.internal.values():
             if not p['isSet'] and p['isRequired']:
                 valid = False
 
+        if names:
+            self.changed(names)
+
         return (valid, changed)
 
 
@@ -0,0 +1,166 @@
+"""
+    Opt-in profiling of poll cycles.
+
+    When enabled, each poll cycle (the poll itself and every fetch job
+    it starts) runs under cProfile, and tracemalloc snapshots taken at
+    the start and end of the cycle show where memory was allocated.
+    The fetch jobs run on the engine's threads, so each gets its own
+    profile and they are merged when the cycle is over.
+
+    The last CYCLES cycles are kept and written to disk on request.
+    When profiling is off the poll doesn't touch any of this.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import io
+import os
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import deque
+
+LOGGER = polyinterface.LOGGER
+
+CYCLES = 10          # cycles kept
+TOP_FUNCTIONS = 25   # functions listed per cycle in the report
+TOP_MEMORY = 10      # allocation sites listed per cycle
+
+class Cycle:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.profiles = []
+        self.unprofiled = 0
+        self.snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+    # Profiles of jobs that finish after the cycle is closed are dropped
+    def _add(self, profile):
+        with self.lock:
+            if not self.closed:
+                self.profiles.append(profile)
+
+    """
+        Run func now, in this thread, under the profiler.  Since Python
+        3.12 only one profiler can be active at a time, so a job that
+        overlaps another one runs without it.  It's counted, but the
+        job itself must not be lost.
+    """
+    def call(self, func, *args):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            with self.lock:
+                self.unprofiled += 1
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            self._add(profile)
+
+    # A version of func that profiles itself when it runs, on any thread
+    def wrap(self, func):
+        def profiled(*args):
+            return self.call(func, *args)
+        return profiled
+
+    # The cycle and its jobs are done.
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.profiler.finish(self)
+
+class CycleProfiler:
+    def __init__(self, cycles=CYCLES):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.results = deque(maxlen=cycles)
+
+    def enable(self, enabled):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        if enabled:
+            LOGGER.info('Profiling poll cycles')
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        else:
+            LOGGER.info('Profiling stopped')
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def cycle(self, name):
+        return Cycle(self, name)
+
+    def finish(self, cycle):
+        duration = time.time() - cycle.started
+        try:
+            stats = pstats.Stats(*cycle.profiles)
+        except Exception as e:
+            LOGGER.debug('No profile for ' + cycle.name + ': ' + str(e))
+            return
+
+        memory = []
+        peak = 0
+        if cycle.snapshot is not None and tracemalloc.is_tracing():
+            diff = tracemalloc.take_snapshot().compare_to(cycle.snapshot, 'lineno')
+            memory = [str(d) for d in diff[0:TOP_MEMORY]]
+            peak = tracemalloc.get_traced_memory()[1]
+
+        with self.lock:
+            self.results.append({
+                'name': cycle.name,
+                'started': cycle.started,
+                'duration': duration,
+                'stats': stats,
+                'memory': memory,
+                'peak': peak,
+                'unprofiled': cycle.unprofiled,
+                })
+
+    """
+        Write the kept cycles to directory: a text report and the merged
+        profile in pstats format (for snakeviz, gprof2dot, etc.)
+        Returns the path of the report or None if there's nothing to
+        write.
+    """
+    def dump(self, directory):
+        with self.lock:
+            results = list(self.results)
+        if len(results) == 0:
+            LOGGER.info('No poll cycles have been profiled')
+            return None
+
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, 'profile-' + time.strftime('%Y%m%d-%H%M%S'))
+        merged = pstats.Stats()
+        with open(base + '.txt', 'w') as f:
+            for r in results:
+                f.write('%s at %s, %.3f seconds, peak traced memory %d KiB\n' %
+                        (r['name'], time.strftime('%Y-%m-%d %H:%M:%S',
+                         time.localtime(r['started'])), r['duration'], r['peak'] // 1024))
+                stream = io.StringIO()
+                r['stats'].stream = stream
+                r['stats'].sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+                f.write(stream.getvalue())
+                if r['unprofiled']:
+                    f.write('%d jobs ran without the profiler, another one was active\n' %
+                            r['unprofiled'])
+                if r['memory']:
+                    f.write('Memory allocated during the cycle:\n')
+                    for line in r['memory']:
+                        f.write('    ' + line + '\n')
+                f.write('\n')
+                merged.add(r['stats'])
+        merged.dump_stats(base + '.prof')
+        LOGGER.info('Wrote profile of %d poll cycles to %s.txt' % (len(results), base))
+        return base + '.txt'
@@ -0,0 +1,79 @@
+"""
+    Driver updates collected over a poll cycle.
+
+    While a batch is open update_driver records each change here instead
+    of sending it.  Nothing is sent until all the cycle's queries have
+    been processed, then flush() sends the changes node by node.  A
+    driver that is updated more than once in the cycle (a unit change,
+    the same value reached from two queries) is only sent once, with its
+    last value.
+
+    Polyglot v2 takes one status message per driver, so that is the
+    smallest number of messages: one for each driver that changed.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import threading
+import metrics
+
+LOGGER = polyinterface.LOGGER
+
+MESSAGES = metrics.REGISTRY.counter('weatherbit_driver_messages_total')
+
+class PublishBatch:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = None     # address -> [node, {driver: [value, force, uom]}]
+        self.superseded = 0
+
+    def open(self):
+        with self.lock:
+            if self.pending is None:
+                self.pending = {}
+
+    """
+        Record a driver change.  Returns False if no batch is open, the
+        caller should send it right away.
+    """
+    def add(self, node, driver, value, force, uom):
+        with self.lock:
+            if self.pending is None:
+                return False
+            entry = self.pending.get(node.address)
+            if entry is None:
+                entry = [node, {}]
+                self.pending[node.address] = entry
+            last = entry[1].get(driver)
+            if last is not None:
+                self.superseded += 1
+                force = force or last[1]
+            entry[1][driver] = [value, force, uom]
+        return True
+
+    # Close the batch and send everything in it.  Returns the number of
+    # values sent.
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            superseded = self.superseded
+            self.pending = None
+            self.superseded = 0
+        if not pending:
+            return 0
+
+        count = 0
+        for (node, drivers) in pending.values():
+            for driver in drivers:
+                (value, force, uom) = drivers[driver]
+                try:
+                    node.setDriver(driver, value, True, force, uom)
+                    MESSAGES.inc()
+                    count += 1
+                except Exception as e:
+                    LOGGER.warning('Failed to send ' + node.address + ' ' + driver + ': ' + str(e))
+        LOGGER.debug('Sent %d driver values for %d nodes, %d superseded' %
+                     (count, len(pending), superseded))
+        return count
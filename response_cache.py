@@ -0,0 +1,197 @@
+"""
+    Response cache for WeatherBit API queries.
+
+    Responses are cached by endpoint, location, units and any extra
+    query parameters (i.e. number of forecast days).  Each endpoint has
+    its own time to live which is overridden by the server's
+    Cache-Control max-age when present.  ETag and Last-Modified values
+    are kept so that an expired entry can be revalidated with a
+    conditional request instead of downloading the full payload again.
+
+    If a path is given, the cache is also written to disk so that a
+    restart within the TTL doesn't need to query the service at all.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import os
+import re
+import json
+import time
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+# Default time to live, in seconds, for each endpoint.
+DEFAULT_TTL = {
+        'current': 120,
+        'forecast/daily': 540,
+        'forecast/hourly': 1740,
+        'history/daily': 3600,
+        'current/airquality': 1740,
+        'forecast/airquality': 3540,
+        'alerts': 50,          # less than alert_index.FAST_INTERVAL
+        }
+FALLBACK_TTL = 60
+
+# Expired entries are kept this long, in seconds, as the last good data
+# for when the service is down, then dropped.
+KEEP_EXPIRED = 86400
+MAX_ENTRIES = 200
+
+class ResponseCache:
+    def __init__(self, ttl=None, path=None):
+        self.ttl = dict(DEFAULT_TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+
+        if self.path is not None:
+            self.load()
+
+    def key(self, endpoint, location, units, extra=None):
+        key = endpoint + '|' + location + '|' + units
+        if extra:
+            for k in sorted(extra):
+                key += '|' + str(k) + '=' + str(extra[k])
+        return key
+
+    # Return the cached data if it is still fresh, otherwise None
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['expires'] > time.time():
+                LOGGER.debug('cache hit for ' + key)
+                return entry['data']
+        return None
+
+    # Is there an entry that hasn't expired yet?
+    def fresh(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry['expires'] > time.time()
+
+    # Return the cached data regardless of age
+    def get_stale(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry['data']
+        return None
+
+    # Headers needed to revalidate an expired entry
+    def validators(self, key):
+        headers = {}
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry['etag']:
+                    headers['If-None-Match'] = entry['etag']
+                if entry['last_modified']:
+                    headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, key, endpoint, data, headers):
+        max_age = self.max_age(headers)
+        if max_age is None:
+            max_age = self.ttl.get(endpoint, FALLBACK_TTL)
+        elif max_age == 0:
+            return
+
+        with self.lock:
+            self.entries[key] = {
+                    'data': data,
+                    'expires': time.time() + max_age,
+                    'etag': headers.get('ETag'),
+                    'last_modified': headers.get('Last-Modified'),
+                    }
+        self.save()
+
+    # A 304 response was received, the cached data is still good.
+    def refresh(self, key, endpoint, headers):
+        max_age = self.max_age(headers)
+        if max_age is None:
+            max_age = self.ttl.get(endpoint, FALLBACK_TTL)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            entry['expires'] = time.time() + max_age
+            data = entry['data']
+        self.save()
+        return data
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+        self.save()
+
+    """
+        Parse Cache-Control.  Returns None if the server didn't say,
+        0 if the response must not be cached, otherwise max-age.
+    """
+    def max_age(self, headers):
+        cc = headers.get('Cache-Control')
+        if cc is None:
+            return None
+
+        cc = cc.lower()
+        if 'no-store' in cc or 'no-cache' in cc:
+            return 0
+
+        m = re.search(r'max-age=(\d+)', cc)
+        if m:
+            return int(m.group(1))
+        return None
+
+    """
+        Drop entries that expired more than KEEP_EXPIRED ago, such as the
+        ones for old locations or backfill dates, and the oldest ones if
+        there are still too many.  Called with the lock held.
+    """
+    def prune(self):
+        cutoff = time.time() - KEEP_EXPIRED
+        for key in [k for k in self.entries if self.entries[k]['expires'] < cutoff]:
+            del self.entries[key]
+        if len(self.entries) > MAX_ENTRIES:
+            oldest = sorted(self.entries, key=lambda k: self.entries[k]['expires'])
+            for key in oldest[0:len(self.entries) - MAX_ENTRIES]:
+                del self.entries[key]
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+            with self.lock:
+                self.prune()
+            LOGGER.debug('Loaded %d cached responses' % len(self.entries))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            LOGGER.warning('Failed to load response cache: ' + str(e))
+            self.entries = {}
+
+    def save(self):
+        if self.path is None:
+            return
+
+        # Only the snapshot is taken under the lock, queries don't wait
+        # for the file to be written.  Saves are in order so an older
+        # snapshot can't overwrite a newer one.
+        with self.save_lock:
+            with self.lock:
+                self.prune()
+                text = json.dumps(self.entries)
+            tmp = self.path + '.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    f.write(text)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                LOGGER.warning('Failed to save response cache: ' + str(e))
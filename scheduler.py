@@ -0,0 +1,216 @@
+"""
+    Quota aware poll scheduler.
+
+    WeatherBit limits the number of API calls per day.  Instead of
+    querying every endpoint on each shortPoll/longPoll, the poll
+    routines ask the scheduler which endpoint/location queries are due.
+
+    The daily call budget is split between the endpoints by share and
+    then evenly between the locations to get the interval for each
+    query.  The rate limit headers in the API responses are used to
+    slow down when the remaining calls are running low and a 429
+    response stops all queries until the limit resets.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import time
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+DEFAULT_BUDGET = 500
+DAY = 86400
+
+# Share of the daily budget for each endpoint.  The forecast only
+# changes a few times a day so most of the calls go to current conditions.
+SHARES = {
+        'current': 0.7,
+        'forecast/daily': 0.15,
+        'forecast/hourly': 0.15,
+        'current/airquality': 0.1,
+        'forecast/airquality': 0.05,
+        'alerts': 0.2,
+        }
+
+# Never query an endpoint more often than this, in seconds.
+MIN_INTERVAL = {
+        'current': 60,
+        'forecast/daily': 1800,
+        'forecast/hourly': 1800,
+        'current/airquality': 1800,
+        'forecast/airquality': 3600,
+        'alerts': 300,
+        }
+
+# Share of the daily budget set aside for polling an endpoint faster
+# with set_fast().  Once it's used up the endpoint goes back to its
+# normal rate until the next day (UTC).
+FAST_SHARES = {
+        'alerts': 0.2,
+        }
+
+LOW_WATER = 0.1        # fraction of calls left before slowing down
+BACKOFF = 900          # wait after a 429 when the server doesn't say
+MAX_BACKOFF = 3600 * 6
+
+class PollScheduler:
+    def __init__(self, budget=DEFAULT_BUDGET, locations=1):
+        self.lock = threading.Lock()
+        self.next_run = {}
+        self.interval = {}
+        self.fast = {}          # (endpoint, index) -> shorter interval
+        self.fast_budget = {}   # endpoint -> fast calls allowed per day
+        self.fast_used = {}     # endpoint -> fast calls made today
+        self.fast_day = None
+        self.booked = {}        # (endpoint, index) -> (previous next_run, fast call)
+        self.blocked_until = 0
+        self.backoff = BACKOFF
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.configure(budget, locations)
+
+    """
+        Split the daily budget into a poll interval per endpoint.  Only
+        the endpoints in use share the budget, after the calls set aside
+        for fast polling.
+    """
+    def configure(self, budget, locations, endpoints=None):
+        locations = max(locations, 1)
+        if endpoints is None:
+            endpoints = list(SHARES)
+        total = sum([SHARES[e] for e in endpoints])
+        with self.lock:
+            self.budget = budget
+            self.locations = locations
+            self.endpoints = endpoints
+            self.fast_budget = {}
+            for endpoint in endpoints:
+                if endpoint in FAST_SHARES:
+                    self.fast_budget[endpoint] = int(budget * FAST_SHARES[endpoint])
+            budget -= sum(self.fast_budget.values())
+            self.interval = {}
+            for endpoint in endpoints:
+                calls = max(budget * SHARES[endpoint] / total / locations, 1)
+                self.interval[endpoint] = max(DAY / calls, MIN_INTERVAL[endpoint])
+                LOGGER.info('Polling %s every %d seconds for each of %d locations' %
+                            (endpoint, self.interval[endpoint], locations))
+            self.next_run = {}
+            self.booked = {}
+
+    # Can another fast call be made today?
+    def _fast_allowed(self, endpoint, now):
+        day = int(now // DAY)
+        if day != self.fast_day:
+            self.fast_day = day
+            self.fast_used = {}
+        return self.fast_used.get(endpoint, 0) < self.fast_budget.get(endpoint, 0)
+
+    # Interval for an endpoint, stretched if we are close to the limit
+    def _interval(self, endpoint, now, key=None):
+        interval = self.interval[endpoint]
+        if key in self.fast and self._fast_allowed(endpoint, now):
+            self.fast_used[endpoint] = self.fast_used.get(endpoint, 0) + 1
+            if self.fast_used[endpoint] == self.fast_budget[endpoint]:
+                LOGGER.warning('Fast polling calls for %s used up for today' % endpoint)
+            interval = min(interval, self.fast[key])
+        if self.remaining is None or self.limit is None or self.reset is None:
+            return interval
+
+        if self.remaining < self.limit * LOW_WATER and self.reset > now:
+            jobs = len(self.endpoints) * self.locations
+            spread = (self.reset - now) * jobs / max(self.remaining, 1)
+            if spread > interval:
+                LOGGER.debug('%d calls left, slowing %s to %d seconds' %
+                             (self.remaining, endpoint, spread))
+                interval = spread
+        return interval
+
+    """
+        Is a query for this endpoint and location due?  If it is, the
+        next one is scheduled.  Forced queries are always due unless
+        the server has told us to stop.
+    """
+    def due(self, endpoint, index, force=False):
+        now = time.time()
+        with self.lock:
+            if endpoint not in self.interval:
+                return False
+            if now < self.blocked_until:
+                LOGGER.debug('Rate limited, skipping ' + endpoint)
+                return False
+
+            key = (endpoint, index)
+            if not force and now < self.next_run.get(key, 0):
+                return False
+
+            # _interval() counts a fast call under the same condition
+            fast = key in self.fast and self._fast_allowed(endpoint, now)
+            self.booked[key] = (self.next_run.get(key), fast)
+            self.next_run[key] = now + self._interval(endpoint, now, key)
+            return True
+
+    """
+        Undo the last due() for this endpoint and location, the query
+        wasn't started after all.  It's due again when it would have
+        been without that call.
+    """
+    def release(self, endpoint, index):
+        key = (endpoint, index)
+        with self.lock:
+            booked = self.booked.pop(key, None)
+            if booked is None:
+                return
+            (previous, fast) = booked
+            if previous is None:
+                self.next_run.pop(key, None)
+            else:
+                self.next_run[key] = previous
+            if fast and self.fast_used.get(endpoint, 0) > 0:
+                self.fast_used[endpoint] -= 1
+
+    """
+        Query an endpoint for a location more often for a while, i.e.
+        while there are weather alerts.  The calls come out of the
+        endpoint's FAST_SHARES part of the budget.  Set interval to None
+        to go back to the normal rate.
+    """
+    def set_fast(self, endpoint, index, interval):
+        key = (endpoint, index)
+        with self.lock:
+            if interval is None:
+                self.fast.pop(key, None)
+                return
+            self.fast[key] = interval
+            if key in self.next_run and self._fast_allowed(endpoint, time.time()):
+                self.next_run[key] = min(self.next_run[key], time.time() + interval)
+
+    # Track the rate limit state from an API response
+    def update(self, status, headers):
+        now = time.time()
+        with self.lock:
+            try:
+                if 'X-RateLimit-Limit' in headers:
+                    self.limit = int(headers['X-RateLimit-Limit'])
+                if 'X-RateLimit-Remaining' in headers:
+                    self.remaining = int(headers['X-RateLimit-Remaining'])
+                if 'X-RateLimit-Reset' in headers:
+                    self.reset = int(headers['X-RateLimit-Reset'])
+            except ValueError:
+                LOGGER.debug('Unable to parse rate limit headers')
+
+            if status == 429:
+                if 'Retry-After' in headers and headers['Retry-After'].isdigit():
+                    self.blocked_until = now + int(headers['Retry-After'])
+                elif self.reset is not None and self.reset > now:
+                    self.blocked_until = self.reset
+                else:
+                    self.blocked_until = now + self.backoff
+                    self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+                LOGGER.warning('WeatherBit rate limit reached, pausing queries for %d seconds' %
+                               (self.blocked_until - now))
+            elif status < 400:
+                self.backoff = BACKOFF
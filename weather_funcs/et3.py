@@ -5,6 +5,10 @@
 # http://edis.ifas.ufl.edu/pdffiles/ae/ae45900.pdf
 
 import math
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # Formulas and constants
 vaporRate = 237.3
@@ -22,7 +26,7 @@ def w2mj (watt):  # watts/m2 to megajoul/m2
     return watt * 0.0864
 
 def mph2ms (mph): # MPH to m/s
-    return mph * 0.477
+    return mph * 0.44704
 
 def kph2ms (kph): # KPH to m/s
     return kph * 0.277778
@@ -68,8 +72,15 @@ def relative_earth_sun_distance(julian_day):
 def solar_declination(julian_day):
     return 0.409 * math.sin(((2 * math.pi) / 365) * julian_day - 1.39)
 
+# Near the poles the sun may not set or rise at all and the acos
+# argument is outside of -1 to 1.
 def sunset_hour_angle(latitude, solar_declination):
-    return math.acos(-1 * math.tan(latitude) * math.tan(solar_declination))
+    x = -1 * math.tan(latitude) * math.tan(solar_declination)
+    if x >= 1.0:    # polar night, sun doesn't rise
+        return 0.0
+    if x <= -1.0:   # midnight sun, sun doesn't set
+        return math.pi
+    return math.acos(x)
 
 def extraterrestrial_radiation(diff, angle, latitude, declination):
     rel1 = 24*60 / math.pi
@@ -84,9 +95,33 @@ def long_wave_radiation(min_t, max_t, vp, sr, clear_sky):
     rel1 = 4.903 * math.pow(10, -9);
     rel2 = (math.pow((max_t + kelvin), 4) + math.pow((min_t + kelvin), 4)) / 2
     rel3 = (0.34 - 0.14 * math.sqrt(vp));
-    rel4 = 1.35 * sr / clear_sky - 0.35;
+    if clear_sky > 0:
+        rel4 = 1.35 * sr / clear_sky - 0.35;
+    else:  # no sun at all (polar night), treat as clear sky
+        rel4 = 1.0
     return rel1 * rel2 * rel3 * rel4;
 
+# Extraterrestrial radiation for each day of the year only depends on
+# the latitude so it's calculated once per latitude and kept here.
+# Index is the julian day, 1 - 366.
+_radiation_tables = {}
+
+def extraterrestrial_table(latitude):  # latitude in degrees
+    key = round(latitude, 4)
+    table = _radiation_tables.get(key)
+    if table is None:
+        latitude_r = deg2rad(latitude)
+        table = [0.0]
+        for julian_day in range(1, 367):
+            declination = solar_declination(julian_day)
+            angle = sunset_hour_angle(latitude_r, declination)
+            dist = relative_earth_sun_distance(julian_day)
+            table.append(extraterrestrial_radiation(dist, angle, latitude_r, declination))
+        if np is not None:
+            table = np.array(table)
+        _radiation_tables[key] = table
+    return table
+
 # calculate the approx. solar radiation  in mega-joules/m2
 def calc_solar_radiation(t_min, t_max, lat, declination, julian_day):
 
@@ -149,27 +184,17 @@ def evapotranspriation(max_t, min_t, solar_radiation, avg_ws, elevation, max_h,
     # step 11.1, vapor pressure deficit
     vp_deficit = vp_curve - vp_actual
 
-    # step 12.1, relative sun earth distance
-    dist = relative_earth_sun_distance(julian_day)
-
-    # step 12.2, solar declination
-    declination = solar_declination(julian_day)
-
-    # step 13, latitude in radians
-    latitude_r = deg2rad(latitude)
+    # steps 12 - 15, extraterrestrial radiation.  Only depends on the
+    # day and latitude, see extraterrestrial_table().
+    Ra = float(extraterrestrial_table(latitude)[julian_day])
 
     ## Testing solar radiation calculation
     if solar_radiation is None:
-        Rs = calc_solar_radiation(min_t, max_t, latitude_r, declination, julian_day)
+        # estimated from the temperature range, see calc_solar_radiation()
+        Rs = 0.17 * math.sqrt(max_t - min_t) * Ra
     else:
         Rs = w2mj(solar_radiation)
 
-    # step 14, sunset hour angle
-    angle = sunset_hour_angle(latitude_r, declination)
-
-    # step 15, extraerrestrial radiation
-    Ra = extraterrestrial_radiation(dist, angle, latitude_r, declination)
-
     # step 16, clear sky solar radiation
     Rso = clear_sky_solar_radiation(elevation, Ra)
 
@@ -198,6 +223,89 @@ def evapotranspriation(max_t, min_t, solar_radiation, avg_ws, elevation, max_h,
 
 
 
+"""
+    Array version of evapotranspriation().  All the arguments can be
+    arrays (or lists) and are broadcast against each other so one call
+    can compute ET0 for every forecast day, and with elevation, latitude
+    and canopy_coefficient shaped as columns, for several locations or
+    crop coefficients at once.  Terms that only depend on elevation or
+    latitude are computed once and for a single latitude, the
+    extraterrestrial radiation comes from extraterrestrial_table().
+    Solar radiation is always estimated from the temperature range.
+
+    numpy's per call overhead makes this slower than a loop over
+    evapotranspriation() for a single location and crop coefficient, it
+    wins from about four crop coefficients or locations per call.
+
+    Falls back to calling evapotranspriation() for each value when
+    numpy isn't installed.
+"""
+def evapotranspriation_array(max_t, min_t, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day):
+    if np is None:
+        return [evapotranspriation(mx, mn, None, ws, el, hx, hn, lat, cc, j) for (mx, mn, ws, el, hx, hn, lat, cc, j) in
+                zip(*_broadcast_lists(max_t, min_t, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day))]
+
+    latitude_is_scalar = np.ndim(latitude) == 0
+    (max_t, min_t, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day) = \
+            np.broadcast_arrays(*[np.asarray(a, dtype=float) for a in
+                (max_t, min_t, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day)])
+
+    # steps 1 and 4, mean temperature and slope of vapor pressure curve
+    mean_daily_temp = (max_t + min_t) / 2.0
+    sv_mean = 0.6108 * np.exp((enthalpy * mean_daily_temp) / (mean_daily_temp + vaporRate))
+    vp_slope = 4098 * sv_mean / np.square(mean_daily_temp + vaporRate)
+
+    # steps 5 and 6, depend only on elevation
+    psychrometric = 0.000665 * 101.3 * np.power((293 - 0.0065 * elevation) / 293, 5.26)
+
+    # steps 7, 8 and 9
+    bottom = vp_slope + psychrometric * (1 + 0.34 * avg_ws)
+    delta = vp_slope / bottom
+    psi = psychrometric / bottom
+    t_term = 900 / (mean_daily_temp + kelvin) * avg_ws
+
+    # steps 10, 11, vapor pressures
+    sv_max = 0.6108 * np.exp((enthalpy * max_t) / (max_t + vaporRate))
+    sv_min = 0.6108 * np.exp((enthalpy * min_t) / (min_t + vaporRate))
+    vp_curve = (sv_max + sv_min) / 2
+    vp_actual = (sv_min * (max_h / 100) + sv_max * (min_h / 100)) / 2
+
+    # steps 12 - 15, extraterrestrial radiation depends only on day
+    # and latitude.  It's the same as the Ra used to estimate solar
+    # radiation (24 * 60 * 0.082 == 24 * 4.92).
+    if latitude_is_scalar:
+        Ra = extraterrestrial_table(float(latitude.flat[0]))[day.astype(int)]
+    else:
+        dist = 1 + 0.033 * np.cos(((2 * math.pi) / 365) * day)
+        declination = 0.409 * np.sin(((2 * math.pi) / 365) * day - 1.39)
+        latitude_r = np.radians(latitude)
+        angle = np.arccos(np.clip(-np.tan(latitude_r) * np.tan(declination), -1.0, 1.0))
+        Ra = 24 * 60 / math.pi * solarConstant * dist * \
+                (angle * np.sin(latitude_r) * np.sin(declination) +
+                 np.cos(latitude_r) * np.cos(declination) * np.sin(angle))
+
+    # estimated solar radiation, see calc_solar_radiation()
+    Rs = 0.17 * np.sqrt(max_t - min_t) * Ra
+
+    # step 16, clear sky radiation
+    Rso = (0.75 + 2e-5 * elevation) * Ra
+
+    # steps 17 - 19, net radiation
+    Rns = (1 - canopy_coefficient) * Rs
+    # no sun at all (polar night) is treated as clear sky, see long_wave_radiation()
+    cloudiness = np.where(Rso > 0, 1.35 * Rs / np.where(Rso > 0, Rso, 1.0) - 0.35, 1.0)
+    Rnl = 4.903e-9 * (np.power(max_t + kelvin, 4) + np.power(min_t + kelvin, 4)) / 2 * \
+            (0.34 - 0.14 * np.sqrt(vp_actual)) * cloudiness
+    Rng = (Rns - Rnl) * 0.408
+
+    return delta * Rng + psi * t_term * (vp_curve - vp_actual)
+
+# Simple broadcasting of scalars and lists for the non-numpy case
+def _broadcast_lists(*args):
+    n = max([len(a) for a in args if isinstance(a, (list, tuple))] + [1])
+    return [a if isinstance(a, (list, tuple)) else [a] * n for a in args]
+
+
 if __name__ == '__main__':
     #et0 = evapotranspriation(27.3, 10.7, 16.502, 1.3, 98.5, 36, 91, 36.82, 0.17, 289)
 
@@ -206,7 +314,38 @@ if __name__ == '__main__':
 
     et0 = evapotranspriation(27.3, 10.7, None, 1.3, 401.33, 91, 36, 36.82, 0.23, 289)
     print("et0 = ", et0)
-
-
-
-
+    assert abs(et0 - 3.0486611876003247) < 1e-9, et0
+
+    # The table has to match calculating the radiation for the day
+    for lat in (36.82, -33.9, 60.1, 80.0):
+        table = extraterrestrial_table(lat)
+        for day in range(1, 367):
+            declination = solar_declination(day)
+            angle = sunset_hour_angle(deg2rad(lat), declination)
+            Ra = extraterrestrial_radiation(relative_earth_sun_distance(day), angle, deg2rad(lat), declination)
+            assert abs(table[day] - Ra) < 1e-9, (lat, day, table[day], Ra)
+    print("radiation table matches")
+
+    # The array version has to match the scalar version
+    max_t = [27.3, 30.1, 18.4, 5.2]
+    min_t = [10.7, 15.2, 9.9, -3.0]
+    ws = [1.3, 2.4, 0.5, 6.1]
+    rh = [91, 55, 70, 80]
+    days = [289, 172, 1, 355]
+    for (lat, elevation, cc) in ((36.82, 401.33, 0.23), (-33.9, 0, 0.17), (60.1, 1200, 0.5)):
+        et0s = evapotranspriation_array(max_t, min_t, ws, elevation, rh, rh, lat, cc, days)
+        for i in range(0, len(days)):
+            et0 = evapotranspriation(max_t[i], min_t[i], None, ws[i], elevation, rh[i], rh[i], lat, cc, days[i])
+            assert abs(et0s[i] - et0) < 1e-9, (lat, days[i], et0s[i], et0)
+    print("array and scalar results match")
+
+    # Polar night and midnight sun
+    for (lat, day) in ((80.0, 355), (80.0, 172), (-89.9, 172)):
+        table = extraterrestrial_table(lat)
+        angle = sunset_hour_angle(deg2rad(lat), solar_declination(day))
+        assert angle in (0.0, math.pi), (lat, day, angle)
+        assert table[day] >= 0.0, (lat, day, table[day])
+        et0 = evapotranspriation(-20, -30, None, 2.0, 0, 80, 80, lat, 0.23, day)
+        et0s = evapotranspriation_array([-20], [-30], [2.0], 0, [80], [80], lat, 0.23, [day])
+        assert abs(et0s[0] - et0) < 1e-9, (lat, day, et0s[0], et0)
+    print("polar days handled")
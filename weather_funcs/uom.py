@@ -9,103 +9,147 @@
 #
 #  Ideally, there should be no conflicts between forecast and current
 #  condition driver types
+#
+#  Data is always queried in metric units and converted locally.  The
+#  tables are built once and shared by all nodes, so they must not be
+#  modified.
 
 
-def get_uom(units):
+METRIC = {
+        'ST': 2,   # node server status
+        'CLITEMP': 4,   # temperature
+        'CLIHUM': 22,   # humidity
+        'BARPRES': 117, # pressure
+        'WINDDIR': 76,  # direction
+        'DEWPT': 4,     # dew point
+        'RAINRT': 46,   # rain rate
+        'SOLRAD': 74,   # solar radiation
+        'GV0': 4,       # max temp
+        'GV1': 4,       # min temp
+        'GV2': 4,       # feels like
+        'GV4': 49,      # wind speed
+        'GV5': 49,      # wind gusts
+        'GV6': 82,      # rain
+        'GV7': 82,      # snow
+        'GV8': 82,      # snow depth
+        'GV9': 56,      # moon phase
+        'GV10': 56,     # ozone
+        'GV11': 25,     # climate coverage
+        'GV12': 25,     # climate intensity
+        'GV13': 25,     # climate conditions
+        'GV14': 22,     # cloud conditions
+        'GV15': 83,     # visibility
+        'GV16': 71,     # UV index
+        'GV17': 56,     # Air Quality
+        'GV18': 22,     # chance of precipitation
+        'GV19': 25,     # day of week
+        'GV20': 106,    # ETo
+        'GV22': 82,     # ETo total
+        'GV23': 82,     # rain deficit
+        }
+
+UK = {
+        'ST': 2,   # node server status
+        'CLITEMP': 4,   # temperature
+        'CLIHUM': 22,   # humidity
+        'BARPRES': 117, # pressure
+        'WINDDIR': 76,  # direction
+        'DEWPT': 4,     # dew point
+        'RAINRT': 24,   # rain rate
+        'SOLRAD': 74,   # solar radiation
+        'GV0': 4,       # max temp
+        'GV1': 4,       # min temp
+        'GV2': 4,       # feels like
+        'GV4': 48,      # wind speed
+        'GV5': 48,      # wind gusts
+        'GV6': 82,      # rain
+        'GV7': 82,      # snow
+        'GV8': 82,      # snow depth
+        'GV9': 56,      # moon phase
+        'GV10': 56,     # ozone
+        'GV11': 25,     # climate coverage
+        'GV12': 25,     # climate intensity
+        'GV13': 25,     # climate conditions
+        'GV14': 22,     # cloud conditions
+        'GV15': 116,    # visibility
+        'GV16': 71,     # UV index
+        'GV17': 56,     # Air Quality
+        'GV18': 22,     # chance of precipitation
+        'GV19': 25,     # day of week
+        'GV20': 106,    # ETo
+        'GV22': 82,     # ETo total
+        'GV23': 82,     # rain deficit
+        }
+
+IMPERIAL = {
+        'ST': 2,   # node server status
+        'CLITEMP': 17,  # temperature
+        'CLIHUM': 22,   # humidity
+        'BARPRES': 117, # pressure (always mb)
+        'WINDDIR': 76,  # direction
+        'DEWPT': 17,    # dew point
+        'RAINRT': 24,   # rain rate
+        'SOLRAD': 74,   # solar radiation
+        'GV0': 17,      # max temp
+        'GV1': 17,      # min temp
+        'GV2': 17,      # feels like
+        'GV4': 48,      # wind speed
+        'GV5': 48,      # wind gusts
+        'GV6': 105,     # rain
+        'GV7': 105,     # snow
+        'GV8': 105,     # snow depth
+        'GV9': 56,      # moon phase
+        'GV10': 56,     # ozone
+        'GV11': 25,     # climate coverage
+        'GV12': 25,     # climate intensity
+        'GV13': 25,     # climate conditions
+        'GV14': 22,     # cloud conditions
+        'GV15': 116,    # visibility
+        'GV16': 71,     # UV index
+        'GV17': 56,     # Air Quality
+        'GV18': 22,     # chance of precipitation
+        'GV19': 25,     # day of week
+        'GV20': 106,    # ETo
+        'GV22': 105,    # ETo total
+        'GV23': 105,    # rain deficit
+        }
+
+# Convert a metric value to the unit of measure, keyed by (metric uom,
+# uom) pairs.
+CONVERSIONS = {
+        (4, 17): lambda c: c * 1.8 + 32,         # C -> F
+        (49, 48): lambda ms: ms * 2.2369363,     # m/s -> mph
+        (82, 105): lambda mm: mm / 25.4,         # mm -> inches
+        (46, 24): lambda mmh: mmh / 25.4,        # mm/hr -> inches/hr
+        (83, 116): lambda km: km * 0.6213712,    # km -> miles
+        }
+
+def _conversions(table):
+    functions = {}
+    for driver in table:
+        if table[driver] != METRIC[driver]:
+            functions[driver] = CONVERSIONS[(METRIC[driver], table[driver])]
+    return functions
+
+METRIC_CONVERSIONS = {}
+UK_CONVERSIONS = _conversions(UK)
+IMPERIAL_CONVERSIONS = _conversions(IMPERIAL)
+
+def _table(units):
     unit_cfg = units.lower()
 
     if unit_cfg == 'metric' or unit_cfg == 'si' or unit_cfg.startswith('m'):
-        uom = {
-            'ST': 2,   # node server status
-            'CLITEMP': 4,   # temperature
-            'CLIHUM': 22,   # humidity
-            'BARPRES': 117, # pressure
-            'WINDDIR': 76,  # direction
-            'DEWPT': 4,     # dew point
-            'RAINRT': 46,   # rain rate
-            'SOLRAD': 74,   # solar radiation
-            'GV0': 4,       # max temp
-            'GV1': 4,       # min temp
-            'GV2': 4,       # feels like
-            'GV4': 49,      # wind speed
-            'GV5': 49,      # wind gusts
-            'GV6': 82,      # rain
-            'GV7': 82,      # snow
-            'GV8': 82,      # snow depth
-            'GV9': 56,      # moon phase
-            'GV10': 56,     # ozone
-            'GV11': 25,     # climate coverage
-            'GV12': 25,     # climate intensity
-            'GV13': 25,     # climate conditions
-            'GV14': 22,     # cloud conditions
-            'GV15': 83,     # visibility
-            'GV16': 71,     # UV index
-            'GV17': 56,     # Air Quality
-            'GV18': 22,     # chance of precipitation
-            'GV19': 25,     # day of week
-            'GV20': 106,    # ETo
-        }
+        return (METRIC, METRIC_CONVERSIONS)
     elif unit_cfg == 'uk':
-        uom = {
-            'ST': 2,   # node server status
-            'CLITEMP': 4,   # temperature
-            'CLIHUM': 22,   # humidity
-            'BARPRES': 117, # pressure
-            'WINDDIR': 76,  # direction
-            'DEWPT': 4,     # dew point
-            'RAINRT': 24,   # rain rate
-            'SOLRAD': 74,   # solar radiation
-            'GV0': 4,       # max temp
-            'GV1': 4,       # min temp
-            'GV2': 4,       # feels like
-            'GV4': 48,      # wind speed
-            'GV5': 48,      # wind gusts
-            'GV6': 82,      # rain
-            'GV7': 82,      # snow
-            'GV8': 82,      # snow depth
-            'GV9': 56,      # moon phase
-            'GV10': 56,     # ozone
-            'GV11': 25,     # climate coverage
-            'GV12': 25,     # climate intensity
-            'GV13': 25,     # climate conditions
-            'GV14': 22,     # cloud conditions
-            'GV15': 116,    # visibility
-            'GV16': 71,     # UV index
-            'GV17': 56,     # Air Quality
-            'GV18': 22,     # chance of precipitation
-            'GV19': 25,     # day of week
-            'GV20': 106,    # ETo
-        }
+        return (UK, UK_CONVERSIONS)
     else:
-        uom = {
-            'ST': 2,   # node server status
-            'CLITEMP': 17,  # temperature
-            'CLIHUM': 22,   # humidity
-            'BARPRES': 117, # pressure (always mb)
-            'WINDDIR': 76,  # direction
-            'DEWPT': 17,    # dew point
-            'RAINRT': 24,   # rain rate
-            'SOLRAD': 74,   # solar radiation
-            'GV0': 17,      # max temp
-            'GV1': 17,      # min temp
-            'GV2': 17,      # feels like
-            'GV4': 48,      # wind speed
-            'GV5': 48,      # wind gusts
-            'GV6': 105,     # rain
-            'GV7': 105,     # snow
-            'GV8': 105,     # snow depth
-            'GV9': 56,      # moon phase
-            'GV10': 56,     # ozone
-            'GV11': 25,     # climate coverage
-            'GV12': 25,     # climate intensity
-            'GV13': 25,     # climate conditions
-            'GV14': 22,     # cloud conditions
-            'GV15': 116,    # visibility
-            'GV16': 71,     # UV index
-            'GV17': 56,     # Air Quality
-            'GV18': 22,     # chance of precipitation
-            'GV19': 25,     # day of week
-            'GV20': 106,    # ETo
-        }
+        return (IMPERIAL, IMPERIAL_CONVERSIONS)
+
+def get_uom(units):
+    return _table(units)[0]
 
-    return uom
+# Return a dictionary of functions, keyed by driver, that convert the
+# metric value to the requested units.  Drivers that don't need a
+# conversion aren't included.
+def get_conversions(units):
+    return _table(units)[1]
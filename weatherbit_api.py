@@ -0,0 +1,242 @@
+"""
+    HTTP transport for the WeatherBit API.
+
+    A single requests session is kept for the life of the node server so
+    that the TCP (and TLS) connections are pooled and kept alive between
+    polls.  Each endpoint/query combination is prepared once and the
+    prepared request is re-sent on every poll.
+
+    Responses are decoded as they are received, see json_stream.
+
+    Responses are kept in a ResponseCache so that repeated queries within
+    the endpoint's TTL don't go out to the service.  The rate limit
+    state of each response is passed on to the poll scheduler.
+
+    Failed queries are retried a couple of times with backoff.  If an
+    endpoint keeps failing its circuit opens (see circuit_breaker) and
+    the last good response is used until the service is back.
+
+    Each query is counted by its result (ok, cached, stale, skipped or
+    error) and only the calls that go out to the service are timed.
+"""
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import time
+import codecs
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import parse_qsl
+import response_cache
+import json_stream
+import circuit_breaker
+import metrics
+
+LOGGER = polyinterface.LOGGER
+
+BASE_URL = 'http://api.weatherbit.io/v2.0/'
+CONNECT_TIMEOUT = 5    # seconds to establish a connection
+READ_TIMEOUT = 30      # seconds to wait for the response
+POOL_SIZE = 4          # keep-alive connections per host
+CHUNK_SIZE = 4096      # bytes read at a time while decoding a response
+
+# The last good response, returned when the query failed.  The data is
+# the same, the type tells the caller it isn't new.
+class StaleData(dict):
+    pass
+
+def is_stale(jdata):
+    return isinstance(jdata, StaleData)
+
+# An exception raised by on_record while a response is being decoded.
+# The service did answer, so it isn't retried and doesn't count
+# against the circuit.
+class CallbackError(Exception):
+    def __init__(self, error):
+        super(CallbackError, self).__init__(str(error))
+        self.error = error
+
+def guarded(on_record):
+    if on_record is None:
+        return None
+    def call(index, record):
+        try:
+            on_record(index, record)
+        except Exception as e:
+            raise CallbackError(e)
+    return call
+
+def count(endpoint, result):
+    metrics.REGISTRY.inc('weatherbit_api_requests_total',
+                         (('endpoint', endpoint), ('result', result)))
+
+class WeatherBitAPI:
+    def __init__(self, base_url=BASE_URL, pool_size=POOL_SIZE, cache_file=None,
+                 scheduler=None):
+        self.scheduler = scheduler
+        self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.templates = {}
+        self.breaker = circuit_breaker.CircuitBreaker()
+        self.set_base_url(base_url)
+        self.cache = response_cache.ResponseCache(path=cache_file)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            })
+
+    """
+        Build (or re-use) the prepared request for an endpoint.
+
+        location is the user's Location parameter which is already in
+        query string form (lat=xx&lon=yy, city=Raleigh,NC, etc.)
+    """
+    def prepare(self, endpoint, location, apikey, units, extra=None):
+        key = (endpoint, location, apikey, units,
+               tuple(sorted(extra.items())) if extra else None)
+
+        if key not in self.templates:
+            params = parse_qsl(location, keep_blank_values=True)
+            params.append(('key', apikey))
+            params.append(('units', units))
+            if extra:
+                params.extend(extra.items())
+
+            request = requests.Request('GET', self.base_url + endpoint,
+                                       params=params)
+            self.templates[key] = self.session.prepare_request(request)
+
+        return self.templates[key]
+
+    # Allows pointing the node server at a different server for testing.
+    def set_base_url(self, base_url):
+        if base_url is None or base_url == '':
+            base_url = BASE_URL
+        if not base_url.endswith('/'):
+            base_url += '/'
+        if base_url != getattr(self, 'base_url', None):
+            LOGGER.info('Using WeatherBit API at ' + base_url)
+            self.base_url = base_url
+            self.reset()
+
+    # Drop prepared requests and circuit state, called when the
+    # configuration changes.
+    def reset(self):
+        self.templates = {}
+        self.breaker.reset()
+
+    """
+        Query an endpoint.  The response is decoded as it arrives and
+        on_record(index, record) is called for each record of the 'data'
+        array as soon as it's been parsed, also when the data comes from
+        the cache.  If fields is given, only those fields of the records
+        are kept.  If the query fails and there is an earlier response,
+        that is returned as StaleData.  An exception raised by on_record
+        is passed on as is, the query isn't retried.
+    """
+    def get(self, endpoint, location, apikey, units, extra=None, fields=None,
+            on_record=None):
+        key = self.cache_key(endpoint, location, units, extra, fields)
+        jdata = self.cache.get(key)
+        if jdata is not None:
+            count(endpoint, 'cached')
+            json_stream.replay(jdata, on_record)
+            return jdata
+
+        if not self.breaker.allow(endpoint):
+            return self.stale(key, endpoint, on_record,
+                              circuit_breaker.CircuitOpenError(endpoint + ' circuit is open'))
+
+        attempt = 0
+        while True:
+            try:
+                jdata = self.fetch(key, endpoint, location, apikey, units, extra,
+                                   fields, guarded(on_record))
+                self.breaker.success(endpoint)
+                count(endpoint, 'ok')
+                return jdata
+            except CallbackError as e:
+                self.breaker.success(endpoint)
+                count(endpoint, 'ok')
+                raise e.error
+            except Exception as e:
+                if not circuit_breaker.retryable(e):
+                    self.breaker.success(endpoint)
+                    count(endpoint, 'error')
+                    raise
+                if attempt >= circuit_breaker.RETRIES:
+                    self.breaker.failure(endpoint)
+                    return self.stale(key, endpoint, on_record, e)
+                delay = circuit_breaker.retry_delay(attempt)
+                LOGGER.debug('%s failed (%s), retrying in %.1f seconds' % (endpoint, str(e), delay))
+                time.sleep(delay)
+                attempt += 1
+
+    def cache_key(self, endpoint, location, units, extra=None, fields=None):
+        if fields is not None:
+            extra = dict(extra or {}, fields=','.join(fields))
+        return self.cache.key(endpoint, location, units, extra)
+
+    # Would get() for this query be answered from the cache?
+    def fresh(self, endpoint, location, units, extra=None, fields=None):
+        return self.cache.fresh(self.cache_key(endpoint, location, units, extra, fields))
+
+    # The last good response, if there is one, otherwise raise the error.
+    def stale(self, key, endpoint, on_record, error):
+        jdata = self.cache.get_stale(key)
+        if jdata is None:
+            if isinstance(error, circuit_breaker.CircuitOpenError):
+                count(endpoint, 'skipped')
+            else:
+                count(endpoint, 'error')
+            raise error
+        count(endpoint, 'stale')
+        LOGGER.warning('Using last good ' + endpoint + ' data: ' + str(error))
+        json_stream.replay(jdata, on_record)
+        return StaleData(jdata)
+
+    def fetch(self, key, endpoint, location, apikey, units, extra, fields, on_record):
+        prepared = self.prepare(endpoint, location, apikey, units, extra)
+        validators = self.cache.validators(key)
+        if validators:
+            prepared = prepared.copy()
+            prepared.headers.update(validators)
+        LOGGER.debug('request = %s' % prepared.url)
+
+        with metrics.REGISTRY.timer('weatherbit_api_request_seconds', (('endpoint', endpoint),)):
+            response = self.session.send(prepared, timeout=self.timeout, stream=True)
+        if self.scheduler is not None:
+            self.scheduler.update(response.status_code, response.headers)
+        try:
+            if response.status_code == 304:
+                jdata = self.cache.refresh(key, endpoint, response.headers)
+                if jdata is not None:
+                    LOGGER.debug(endpoint + ' not modified, using cached data')
+                    json_stream.replay(jdata, on_record)
+                    return jdata
+
+            response.raise_for_status()
+            jdata = self.decode(response, fields, on_record)
+            self.cache.store(key, endpoint, jdata, response.headers)
+            return jdata
+        finally:
+            response.close()
+
+    def decode(self, response, fields, on_record):
+        decoder = json_stream.StreamDecoder(fields=fields, on_record=on_record)
+        text = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            decoder.feed(text.decode(chunk))
+        decoder.feed(text.decode(b'', final=True))
+        return decoder.close()
+
+    def close(self):
+        self.session.close()